@@ -1,20 +1,29 @@
-from attendance import create_app, init_db
+from attendance import create_app
 from flask import redirect, url_for
+from migrate_db import prepare_database
 
-# Initialize the database first
-init_db()
 
-app = create_app()
+def build_app():
+    app = create_app()
 
-# Add a root route to redirect to portal selection page
-@app.route('/')
-def index():
-    return redirect('/portal')
+    # Add a root route to redirect to portal selection page
+    @app.route('/')
+    def index():
+        return redirect('/portal')
 
-# Add a new route for portal selection
-@app.route('/portal')
-def portal_selection():
-    return redirect(url_for('admin.portal_selection'))
+    # Add a new route for portal selection
+    @app.route('/portal')
+    def portal_selection():
+        return redirect(url_for('admin.portal_selection'))
+
+    return app
+
+
+# gunicorn serves app:app. The recognition pool's spawned workers import this file again as __mp_main__;
+# they only run jobs, so they must not build an app of their own.
+if __name__ != "__mp_main__":
+    app = build_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    prepare_database()
+    app.run(debug=True)
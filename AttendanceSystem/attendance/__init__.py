@@ -1,6 +1,16 @@
 from flask import Flask
 import os
-from .db import init_db
+import json
+from .db import init_db, close_db, configure as configure_db
+from .gallery import gallery
+from .workers import recognition_pool
+from .jobs import scan_jobs
+from .admission import scan_admission
+from .tracking import stream_sessions
+from .frame_cache import frame_cache
+from .write_behind import attendance_writer
+from .pagination import configure as configure_pagination
+from .changelog import configure as configure_changelog
 
 def create_app():
     app = Flask(__name__)
@@ -8,6 +18,126 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = os.path.join("static", "uploads")
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+    # SQLite tuning: fsync only at WAL checkpoints, memory-mapped reads, and prepared statements kept per connection
+    app.config['DB_SYNCHRONOUS'] = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+    app.config['DB_MMAP_SIZE'] = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+    app.config['DB_CACHED_STATEMENTS'] = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+    configure_db(synchronous=app.config['DB_SYNCHRONOUS'],
+                 mmap_size=app.config['DB_MMAP_SIZE'],
+                 cached_statements=app.config['DB_CACHED_STATEMENTS'])
+    # Write-behind for attendance marks: one writer thread commits queued scans together, up to
+    # ATTENDANCE_BATCH_SIZE rows or ATTENDANCE_FLUSH_MS apart. "commit" durability answers a scan once its
+    # batch committed, "enqueue" as soon as it is queued (a crash can lose the queue). A "commit" scan whose
+    # batch takes longer than ATTENDANCE_COMMIT_TIMEOUT_MS writes its own rows.
+    app.config['ATTENDANCE_WRITE_BEHIND'] = os.environ.get('ATTENDANCE_WRITE_BEHIND', '0') == '1'
+    app.config['ATTENDANCE_DURABILITY'] = os.environ.get('ATTENDANCE_DURABILITY', 'commit')
+    app.config['ATTENDANCE_BATCH_SIZE'] = int(os.environ.get('ATTENDANCE_BATCH_SIZE', 64))
+    app.config['ATTENDANCE_FLUSH_MS'] = float(os.environ.get('ATTENDANCE_FLUSH_MS', 5))
+    app.config['ATTENDANCE_QUEUE_SIZE'] = int(os.environ.get('ATTENDANCE_QUEUE_SIZE', 1024))
+    app.config['ATTENDANCE_COMMIT_TIMEOUT_MS'] = float(os.environ.get('ATTENDANCE_COMMIT_TIMEOUT_MS', 5000))
+    attendance_writer.configure(enabled=app.config['ATTENDANCE_WRITE_BEHIND'],
+                                durability=app.config['ATTENDANCE_DURABILITY'],
+                                batch_size=app.config['ATTENDANCE_BATCH_SIZE'],
+                                flush_interval=app.config['ATTENDANCE_FLUSH_MS'] / 1000,
+                                max_queue=app.config['ATTENDANCE_QUEUE_SIZE'],
+                                commit_timeout=app.config['ATTENDANCE_COMMIT_TIMEOUT_MS'] / 1000)
+    # Each request reuses one connection, closed when the request ends
+    app.teardown_appcontext(close_db)
+
+    # Maximum face distance accepted as a match (lower is stricter)
+    app.config['FACE_MATCH_TOLERANCE'] = float(os.environ.get('FACE_MATCH_TOLERANCE', 0.6))
+
+    # Galleries this large switch from exact search to the approximate IVF index
+    app.config['FACE_INDEX_THRESHOLD'] = int(os.environ.get('FACE_INDEX_THRESHOLD', 5000))
+    app.config['FACE_INDEX_NPROBE'] = int(os.environ.get('FACE_INDEX_NPROBE', 8))
+    # Every Nth approximate search is repeated exactly to measure recall (0 disables)
+    app.config['FACE_INDEX_RECALL_SAMPLE'] = int(os.environ.get('FACE_INDEX_RECALL_SAMPLE', 100))
+    gallery.configure(threshold=app.config['FACE_INDEX_THRESHOLD'],
+                      nprobe=app.config['FACE_INDEX_NPROBE'],
+                      recall_sample_every=app.config['FACE_INDEX_RECALL_SAMPLE'])
+
+    # Named kiosk rooms, e.g. {"room-5": [["5", "A"], ["5", "B"]]}; an empty section means the whole class
+    app.config['KIOSK_ROOMS'] = json.loads(os.environ.get('KIOSK_ROOMS', '{}'))
+    # Retry against every student when a scoped scan finds no match
+    app.config['SCOPE_FALLBACK_TO_FULL'] = os.environ.get('SCOPE_FALLBACK_TO_FULL', '0') == '1'
+
+    # Largest accepted scan frame, and the JPEG quality the kiosk page encodes frames at
+    app.config['MAX_FRAME_BYTES'] = int(os.environ.get('MAX_FRAME_BYTES', 10 * 1024 * 1024))
+    app.config['SCAN_JPEG_QUALITY'] = float(os.environ.get('SCAN_JPEG_QUALITY', 0.8))
+
+    # Detection speed/accuracy profile (fast, balanced, accurate) for single and group scans
+    app.config['DETECTION_PROFILE'] = os.environ.get('DETECTION_PROFILE', 'balanced')
+    app.config['GROUP_DETECTION_PROFILE'] = os.environ.get('GROUP_DETECTION_PROFILE', 'accurate')
+    # Reject frames with no face using a cheap OpenCV Haar cascade before running dlib
+    app.config['FACE_PREFILTER'] = os.environ.get('FACE_PREFILTER', '0') == '1'
+
+    # Recognition worker processes (0 runs dlib inline), queued jobs allowed beyond them, per-job deadline in seconds
+    app.config['RECOGNITION_POOL_SIZE'] = int(os.environ.get('RECOGNITION_POOL_SIZE', 2))
+    app.config['RECOGNITION_QUEUE_DEPTH'] = int(os.environ.get('RECOGNITION_QUEUE_DEPTH', 8))
+    app.config['RECOGNITION_JOB_TIMEOUT'] = float(os.environ.get('RECOGNITION_JOB_TIMEOUT', 10))
+    recognition_pool.configure(size=app.config['RECOGNITION_POOL_SIZE'],
+                               max_queue=app.config['RECOGNITION_QUEUE_DEPTH'],
+                               timeout=app.config['RECOGNITION_JOB_TIMEOUT'])
+
+    # Scan admission control: scans running at once per web worker (0 disables), scans allowed to queue
+    # behind them, and the longest a queued scan waits (seconds) before it is told to retry
+    app.config['SCAN_MAX_IN_FLIGHT'] = int(os.environ.get('SCAN_MAX_IN_FLIGHT', 4))
+    app.config['SCAN_ADMISSION_QUEUE'] = int(os.environ.get('SCAN_ADMISSION_QUEUE', 16))
+    app.config['SCAN_MAX_QUEUE_WAIT'] = float(os.environ.get('SCAN_MAX_QUEUE_WAIT', 2))
+    scan_admission.configure(max_in_flight=app.config['SCAN_MAX_IN_FLIGHT'],
+                             max_queue=app.config['SCAN_ADMISSION_QUEUE'],
+                             max_wait=app.config['SCAN_MAX_QUEUE_WAIT'])
+
+    # Near-duplicate frame cache: entries kept (0 disables), seconds an entry lives, and how many of the
+    # 64 perceptual hash bits may differ for two frames to count as the same picture
+    app.config['FRAME_CACHE_SIZE'] = int(os.environ.get('FRAME_CACHE_SIZE', 256))
+    app.config['FRAME_CACHE_TTL'] = float(os.environ.get('FRAME_CACHE_TTL', 3))
+    app.config['FRAME_CACHE_MAX_DISTANCE'] = int(os.environ.get('FRAME_CACHE_MAX_DISTANCE', 2))
+    frame_cache.configure(max_entries=app.config['FRAME_CACHE_SIZE'],
+                          ttl=app.config['FRAME_CACHE_TTL'],
+                          max_distance=app.config['FRAME_CACHE_MAX_DISTANCE'])
+
+    # Streaming scans: frames per second a kiosk sends, how long a face may vanish before its track ends,
+    # how long an idle kiosk keeps its tracks, and the box overlap that counts as the same face
+    app.config['STREAM_FPS'] = float(os.environ.get('STREAM_FPS', 2))
+    app.config['STREAM_TRACK_TTL'] = float(os.environ.get('STREAM_TRACK_TTL', 2))
+    app.config['STREAM_SESSION_TTL'] = float(os.environ.get('STREAM_SESSION_TTL', 60))
+    app.config['STREAM_MAX_SESSIONS'] = int(os.environ.get('STREAM_MAX_SESSIONS', 200))
+    app.config['STREAM_IOU_THRESHOLD'] = float(os.environ.get('STREAM_IOU_THRESHOLD', 0.3))
+    stream_sessions.configure(track_ttl=app.config['STREAM_TRACK_TTL'],
+                              session_ttl=app.config['STREAM_SESSION_TTL'],
+                              max_sessions=app.config['STREAM_MAX_SESSIONS'])
+
+    # Asynchronous scan jobs: how many are held, how long finished ones are kept (seconds), and the
+    # threads feeding them to the recognition pool. Result callbacks only go to the listed hosts.
+    app.config['SCAN_JOBS_MAX'] = int(os.environ.get('SCAN_JOBS_MAX', 1000))
+    app.config['SCAN_JOB_RETENTION'] = float(os.environ.get('SCAN_JOB_RETENTION', 300))
+    app.config['SCAN_JOB_THREADS'] = int(os.environ.get('SCAN_JOB_THREADS', 4))
+    app.config['SCAN_JOB_CALLBACK_HOSTS'] = [host for host in os.environ.get('SCAN_JOB_CALLBACK_HOSTS', '').split(',')
+                                             if host]
+    scan_jobs.configure(max_jobs=app.config['SCAN_JOBS_MAX'],
+                        retention=app.config['SCAN_JOB_RETENTION'],
+                        threads=app.config['SCAN_JOB_THREADS'],
+                        callback_hosts=app.config['SCAN_JOB_CALLBACK_HOSTS'])
+
+    # CSV exports: rows fetched and written per chunk, and whether to gzip them for clients that accept it
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    app.config['EXPORT_GZIP'] = os.environ.get('EXPORT_GZIP', '1') == '1'
+    # Rows per compressed block of the columnar export (?format=columnar on /gov/export_data)
+    app.config['COLUMNAR_BLOCK_ROWS'] = int(os.environ.get('COLUMNAR_BLOCK_ROWS', 65536))
+
+    # Records per transaction of /gov/api/import; each committed batch is logged under the upload's idempotency key
+    app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    # Sync peer whose unacknowledged changes the gov dashboard and sync status pages count
+    app.config['SYNC_PEER'] = os.environ.get('SYNC_PEER', 'gov')
+    configure_changelog(peer=app.config['SYNC_PEER'])
+    # Shared secret sync peers send as X-Sync-Token to /gov/api/changes; unset, only gov sessions may sync
+    app.config['SYNC_TOKEN'] = os.environ.get('SYNC_TOKEN', '')
+    # Rows per page of the logs, student list and gov reports (?limit= may ask for up to MAX_PAGE_SIZE)
+    app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 100))
+    app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 500))
+    configure_pagination(page_size=app.config['PAGE_SIZE'], max_page_size=app.config['MAX_PAGE_SIZE'])
+
     # register blueprints
     from .routes_attendance import attendance_bp
     from .routes_admin import admin_bp
@@ -0,0 +1,142 @@
+import bisect
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_MAX_WAIT = 2.0
+# Weight of the newest request in the running service-time average
+SERVICE_TIME_ALPHA = 0.2
+
+# Histogram bucket upper bounds; the last bucket catches everything above
+WAIT_BUCKETS_MS = (0, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+class Overloaded(Exception):
+    """The request was shed; retry_after is a hint in whole seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _histogram(bounds):
+    return [0] * (len(bounds) + 1)
+
+
+def _observe(histogram, bounds, value):
+    histogram[bisect.bisect_left(bounds, value)] += 1
+
+
+def _labelled(histogram, bounds):
+    # Lists rather than a dict so the buckets stay in order through jsonify's key sorting
+    return {"le": list(bounds) + ["inf"], "counts": list(histogram)}
+
+
+class AdmissionControl:
+    """
+    Limits how many scans run the recognition path at once. Up to
+    max_in_flight requests run; up to max_queue more wait in FIFO order for at
+    most max_wait seconds. A request is shed straight away (429) when the queue
+    is full or when the wait it would face, estimated from the recent service
+    time, already exceeds max_wait, so kiosks retry instead of timing out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._waiting = deque()
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        self.max_queue = DEFAULT_MAX_QUEUE
+        self.max_wait = DEFAULT_MAX_WAIT
+        self.in_flight = 0
+        self.service_ms = None
+        self.stats_counters = {"admitted": 0, "shed_queue_full": 0, "shed_deadline": 0, "queue_timeouts": 0}
+        self.wait_histogram = _histogram(WAIT_BUCKETS_MS)
+        self.depth_histogram = _histogram(DEPTH_BUCKETS)
+
+    def configure(self, max_in_flight=None, max_queue=None, max_wait=None):
+        with self._lock:
+            if max_in_flight is not None:
+                self.max_in_flight = max_in_flight
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if max_wait is not None:
+                self.max_wait = max_wait
+            self._ready.notify_all()
+
+    def _estimated_wait(self, position):
+        # Requests ahead of us drain max_in_flight at a time
+        if self.service_ms is None:
+            return 0.0
+        return (position // max(1, self.max_in_flight) + 1) * self.service_ms / 1000
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._estimated_wait(len(self._waiting))))
+
+    @contextmanager
+    def admit(self):
+        """Hold an in-flight slot for the body of the with block, or raise Overloaded."""
+        if self.max_in_flight <= 0:
+            yield
+            return
+
+        arrived = time.perf_counter()
+        with self._ready:
+            depth = len(self._waiting)
+            _observe(self.depth_histogram, DEPTH_BUCKETS, depth)
+            if depth or self.in_flight >= self.max_in_flight:
+                if depth >= self.max_queue:
+                    self.stats_counters["shed_queue_full"] += 1
+                    raise Overloaded("Scanner is busy, please try again", self._retry_after())
+                if self._estimated_wait(depth) > self.max_wait:
+                    self.stats_counters["shed_deadline"] += 1
+                    raise Overloaded("Scanner is busy, please try again", self._retry_after())
+
+                ticket = object()
+                self._waiting.append(ticket)
+                admitted = self._ready.wait_for(
+                    lambda: self._waiting[0] is ticket and self.in_flight < self.max_in_flight, self.max_wait)
+                self._waiting.remove(ticket)
+                # Whoever is now at the head may be able to go
+                self._ready.notify_all()
+                if not admitted:
+                    self.stats_counters["queue_timeouts"] += 1
+                    raise Overloaded("Scanner is busy, please try again", self._retry_after())
+
+            self.in_flight += 1
+            self.stats_counters["admitted"] += 1
+            started = time.perf_counter()
+            _observe(self.wait_histogram, WAIT_BUCKETS_MS, (started - arrived) * 1000)
+
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._ready:
+                self.in_flight -= 1
+                self.service_ms = elapsed_ms if self.service_ms is None else \
+                    SERVICE_TIME_ALPHA * elapsed_ms + (1 - SERVICE_TIME_ALPHA) * self.service_ms
+                self._ready.notify_all()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result.update({
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiting),
+                "avg_service_ms": round(self.service_ms, 2) if self.service_ms is not None else None,
+                "wait_ms_histogram": _labelled(self.wait_histogram, WAIT_BUCKETS_MS),
+                "queue_depth_histogram": _labelled(self.depth_histogram, DEPTH_BUCKETS),
+            })
+        return result
+
+
+scan_admission = AdmissionControl()
@@ -0,0 +1,159 @@
+# Loaded standalone by offline_app.py, so this module must not import from the attendance package
+import datetime
+import json
+
+DEFAULT_PEER = "gov"
+
+# Peer whose marks the dashboards report pending counts for, set from the app config by configure()
+settings = {
+    "peer": DEFAULT_PEER,
+}
+
+# Append-only log of every change to a synced table. Each table numbers its own changes 1, 2, 3, ...
+# so "everything after version n" is one range of the primary key.
+CHANGE_LOG_TABLE = '''CREATE TABLE IF NOT EXISTS change_log (
+                        name TEXT NOT NULL,
+                        version INTEGER NOT NULL,
+                        row_id INTEGER NOT NULL,
+                        op TEXT NOT NULL,
+                        PRIMARY KEY (name, version)
+                    ) WITHOUT ROWID'''
+
+# The last version of each table a peer has acknowledged
+SYNC_PEERS_TABLE = '''CREATE TABLE IF NOT EXISTS sync_peers (
+                        peer TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        mark INTEGER NOT NULL DEFAULT 0,
+                        synced_at TEXT,
+                        PRIMARY KEY (peer, name)
+                    ) WITHOUT ROWID'''
+
+# The columns a peer receives for each synced table; the sync flag and face encodings stay local
+SYNCED_TABLES = {
+    "students": ("name, roll, class, section", ("name", "roll", "class", "section")),
+    "attendance": ("student_id, timestamp", ("student_id", "timestamp")),
+}
+
+CURRENT_VERSION = "SELECT IFNULL(MAX(version), 0) FROM change_log WHERE name = ?"
+CHANGES_AFTER = "SELECT version, row_id FROM change_log WHERE name = ? AND version > ? ORDER BY version"
+
+_APPEND = '''INSERT INTO change_log (name, version, row_id, op)
+                SELECT '{name}', IFNULL(MAX(version), 0) + 1, {row}.id, '{op}' FROM change_log WHERE name = '{name}';'''
+
+
+def configure(**options):
+    settings.update(options)
+
+
+def ensure_change_log(cursor):
+    """
+    Create the change log, the peer marks and the triggers that append to
+    the log. A log created just now starts with one insert per existing row,
+    so a new peer's first sync ships everything.
+
+    Only changes to the columns peers receive are logged; flipping the old
+    synced flag or backfilling derived columns is not a change to ship. A
+    row whose id changes is logged as a delete of the old id and an insert
+    of the new one, so the peer drops the old row instead of keeping both.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+    created = cursor.fetchone() is None
+    cursor.execute(CHANGE_LOG_TABLE)
+    cursor.execute(SYNC_PEERS_TABLE)
+    for name, (columns, _) in SYNCED_TABLES.items():
+        if created:
+            cursor.execute(f'''INSERT INTO change_log (name, version, row_id, op)
+                                SELECT '{name}', ROW_NUMBER() OVER (ORDER BY id), id, 'I' FROM {name}''')
+        for event, row, op in (("INSERT", "NEW", "I"), (f"UPDATE OF {columns}", "NEW", "U"), ("DELETE", "OLD", "D")):
+            cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {name}_change_log_{event.split()[0].lower()}
+                                AFTER {event} ON {name}
+                                BEGIN
+                                    {_APPEND.format(name=name, row=row, op=op)}
+                                END''')
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {name}_change_log_rekey
+                            AFTER UPDATE OF id ON {name}
+                            WHEN OLD.id <> NEW.id
+                            BEGIN
+                                {_APPEND.format(name=name, row="OLD", op="D")}
+                                {_APPEND.format(name=name, row="NEW", op="I")}
+                            END''')
+
+
+def current_versions(conn):
+    """The latest change of each synced table: {'students': n, 'attendance': n}."""
+    return {name: conn.execute(CURRENT_VERSION, (name,)).fetchone()[0] for name in SYNCED_TABLES}
+
+
+def peer_marks(conn, peer):
+    """The last version of each synced table the peer acknowledged; 0 for a peer never synced."""
+    marks = dict.fromkeys(SYNCED_TABLES, 0)
+    marks.update(conn.execute("SELECT name, mark FROM sync_peers WHERE peer = ?", (peer,)).fetchall())
+    return marks
+
+
+def pending_counts(conn, peer=None):
+    """
+    Changes per synced table the peer has not acknowledged yet: the table's
+    current version minus the peer's mark, two index lookups each instead
+    of counting rows.
+    """
+    marks = peer_marks(conn, peer or settings["peer"])
+    return {name: version - marks[name] for name, version in current_versions(conn).items()}
+
+
+def changes_since(conn, marks, limit=None):
+    """
+    The rows changed after marks ({table: version}), oldest change first.
+
+    Returns {table: {"version": last version included, "rows": [...]}}. A
+    row changed several times is shipped once, in its current state; a row
+    deleted since is shipped as {"id": ..., "deleted": True}. With limit,
+    at most that many changes per table are included, and "version" says
+    where to resume.
+    """
+    result = {}
+    for name, (columns, fields) in SYNCED_TABLES.items():
+        mark = marks.get(name, 0)
+        query = CHANGES_AFTER
+        params = [name, mark]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        changes = conn.execute(query, params).fetchall()
+        latest = {row_id: version for version, row_id in changes}
+        rows = []
+        if latest:
+            current = {row[0]: row[1:] for row in conn.execute(
+                f"SELECT id, {columns} FROM {name} WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(latest)),))}
+            for row_id in sorted(latest, key=latest.get):
+                if row_id in current:
+                    rows.append({"id": row_id, **dict(zip(fields, current[row_id]))})
+                else:
+                    rows.append({"id": row_id, "deleted": True})
+        result[name] = {"version": changes[-1][0] if changes else mark, "rows": rows}
+    return result
+
+
+def acknowledge(conn, peer, versions):
+    """
+    Advance the peer's marks to versions ({table: version}); marks never
+    move backwards or past the latest change, so a late or repeated
+    acknowledgement is harmless. Returns the number of changes newly
+    acknowledged. The caller commits.
+    """
+    marks = peer_marks(conn, peer)
+    current = current_versions(conn)
+    now = datetime.datetime.now().isoformat()
+    acknowledged = 0
+    for name, version in versions.items():
+        if name not in SYNCED_TABLES:
+            continue
+        version = min(int(version), current[name])
+        if version <= marks[name]:
+            continue
+        acknowledged += version - marks[name]
+        conn.execute("""INSERT INTO sync_peers (peer, name, mark, synced_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (peer, name) DO UPDATE SET mark = excluded.mark, synced_at = excluded.synced_at""",
+                     (peer, name, version, now))
+    return acknowledged
@@ -0,0 +1,157 @@
+# Loaded standalone by offline_app.py, so this module must not import from the attendance package
+import json
+import struct
+import zlib
+
+import numpy as np
+
+# File layout: MAGIC, a u16 header length and a JSON header naming the columns, then blocks of
+# <u32 compressed length><zlib payload>, ended by a zero length. Each payload is <u32 rows>, the
+# dictionary entries first seen in this block for every dictionary column (<u32 length><JSON list>),
+# then every column as a little-endian array.
+MAGIC = b"ATTCOL"
+FORMAT_VERSION = 1
+DEFAULT_BLOCK_ROWS = 65536
+COMPRESSION_LEVEL = 6
+
+# (name, dtype), in the order EXPORT_QUERY selects them; object columns are dictionary encoded.
+# Numeric columns have no null encoding, so queries leave out rows whose day or ts SQLite could not read.
+COLUMNS = (
+    ("student_id", "<i4"),
+    ("roll", "dict"),
+    ("name", "dict"),
+    ("class", "dict"),
+    ("section", "dict"),
+    ("day", "<i4"),
+    ("ts", "<i8"),
+)
+DICT_CODE = "<i4"
+
+# Days are counted from 1970-01-01, so day and ts share an epoch
+EXPORT_QUERY = """
+    SELECT a.student_id, s.roll, s.name, s.class, s.section,
+           CAST(julianday(a.day) - 2440587.5 AS INTEGER), a.ts
+    FROM attendance a
+    JOIN students s ON a.student_id = s.id
+    WHERE a.day BETWEEN ? AND ? AND a.ts IS NOT NULL
+    ORDER BY a.day, a.student_id
+"""
+
+
+class ColumnarError(Exception):
+    """The file is not a columnar attendance export this reader understands."""
+
+
+def _header():
+    header = json.dumps({"version": FORMAT_VERSION, "columns": [list(column) for column in COLUMNS],
+                         "day_epoch": "1970-01-01"}).encode()
+    return MAGIC + struct.pack("<H", len(header)) + header
+
+
+def columnar_chunks(cursor, block_rows=DEFAULT_BLOCK_ROWS, progress=None):
+    """
+    Yield a columnar export of cursor's rows (in COLUMNS order) as bytes: the
+    header, then one compressed block per fetchmany batch, then the end
+    marker. Only one block of rows is held at a time; the dictionaries grow
+    as new values appear and each block ships just its new entries.
+    """
+    yield _header()
+    dictionaries = {name: {} for name, dtype in COLUMNS if dtype == "dict"}
+    while True:
+        rows = cursor.fetchmany(block_rows)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        payload = [struct.pack("<I", len(rows))]
+        arrays = []
+        for (name, dtype), values in zip(COLUMNS, columns):
+            if dtype != "dict":
+                arrays.append(np.asarray(values, dtype=dtype).tobytes())
+                continue
+            codes = dictionaries[name]
+            # New values get the next codes; both steps stay in C (dict.fromkeys, map) rather than a Python loop
+            added = [value for value in dict.fromkeys(values) if value not in codes]
+            codes.update(zip(added, range(len(codes), len(codes) + len(added))))
+            encoded = np.fromiter(map(codes.__getitem__, values), dtype=DICT_CODE, count=len(values))
+            added = json.dumps(added).encode()
+            payload.append(struct.pack("<I", len(added)) + added)
+            arrays.append(encoded.tobytes())
+        block = zlib.compress(b"".join(payload + arrays), COMPRESSION_LEVEL)
+        if progress is not None:
+            progress["rows"] += len(rows)
+        yield struct.pack("<I", len(block)) + block
+    yield struct.pack("<I", 0)
+
+
+def write_columnar(cursor, path, block_rows=DEFAULT_BLOCK_ROWS):
+    """Write a columnar export of cursor's rows to path; returns the number of rows."""
+    progress = {"rows": 0}
+    with open(path, "wb") as f:
+        for chunk in columnar_chunks(cursor, block_rows, progress):
+            f.write(chunk)
+    return progress["rows"]
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ColumnarError("Truncated columnar export")
+    return data
+
+
+def iter_blocks(f):
+    """
+    Read a columnar export from a binary file object, one block at a time.
+
+    Yields {column: numpy array}; dictionary columns come back as int32 codes
+    into the "<column>_dictionary" list, which is shared by every block and
+    already holds the entries the block refers to.
+    """
+    if _read_exact(f, len(MAGIC)) != MAGIC:
+        raise ColumnarError("Not a columnar attendance export")
+    header = json.loads(_read_exact(f, struct.unpack("<H", _read_exact(f, 2))[0]))
+    if header.get("version") != FORMAT_VERSION:
+        raise ColumnarError(f"Unsupported columnar export version: {header.get('version')}")
+    columns = [tuple(column) for column in header["columns"]]
+    dictionaries = {name: [] for name, dtype in columns if dtype == "dict"}
+
+    while True:
+        size = struct.unpack("<I", _read_exact(f, 4))[0]
+        if size == 0:
+            return
+        payload = memoryview(zlib.decompress(_read_exact(f, size)))
+        rows = struct.unpack_from("<I", payload)[0]
+        offset = 4
+        for name in dictionaries:
+            length = struct.unpack_from("<I", payload, offset)[0]
+            dictionaries[name].extend(json.loads(bytes(payload[offset + 4:offset + 4 + length])))
+            offset += 4 + length
+
+        block = {}
+        for name, dtype in columns:
+            dtype = np.dtype(DICT_CODE if dtype == "dict" else dtype)
+            block[name] = np.frombuffer(payload, dtype=dtype, count=rows, offset=offset)
+            offset += dtype.itemsize * rows
+            if name in dictionaries:
+                block[f"{name}_dictionary"] = dictionaries[name]
+        yield block
+
+
+def read_columnar(path):
+    """
+    Load a whole columnar export: {column: numpy array}, with dictionary
+    columns decoded back to object arrays of their values.
+    """
+    blocks = []
+    with open(path, "rb") as f:
+        for block in iter_blocks(f):
+            blocks.append(block)
+    result = {}
+    for name, dtype in COLUMNS:
+        parts = [block[name] for block in blocks]
+        values = np.concatenate(parts) if parts else np.empty(0, dtype=DICT_CODE if dtype == "dict" else dtype)
+        if dtype == "dict":
+            dictionary = np.array(blocks[-1][f"{name}_dictionary"] if blocks else [], dtype=object)
+            values = dictionary[values] if len(values) else np.empty(0, dtype=object)
+        result[name] = values
+    return result
@@ -0,0 +1,83 @@
+import datetime
+import threading
+
+from .changelog import pending_counts
+from .db import get_data_counts, get_data_versions
+from .rollups import attendance_summary
+
+TODAY_COUNT = "SELECT COUNT(*) FROM attendance WHERE day = ?"
+
+
+class DashboardStats:
+    """
+    Per-worker cache of the admin and gov dashboard counters.
+
+    The counters are stamped with the date and the data_version counters of
+    students, attendance and sync_log, so a dashboard view costs one read of
+    that small table when nothing changed, in this worker or any other. When
+    something did, they are refreshed from the row counts the write paths'
+    triggers keep in data_counts, today's slice of the attendance index, the
+    rollup and the sync peer's change log marks, never by counting whole
+    tables. Acknowledging a sync writes sync_log, so moved marks are seen too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.day = None
+        self.versions = None
+        self.values = None
+        self.hits = 0
+        self.refreshes = 0
+
+    def get(self, conn, today=None):
+        """Return the dashboard counters, refreshing them only when stale."""
+        today = today or datetime.date.today().strftime("%Y-%m-%d")
+        versions = get_data_versions(conn)
+        with self._lock:
+            if self.day == today and self.versions == versions:
+                self.hits += 1
+                return dict(self.values)
+
+        values = self._load(conn, today)
+        with self._lock:
+            self.day, self.versions, self.values = today, versions, values
+            self.refreshes += 1
+            return dict(values)
+
+    @staticmethod
+    def _load(conn, today):
+        counts = get_data_counts(conn)
+        # Rows with a change the sync peer has not acknowledged; a row changed twice counts twice
+        pending = pending_counts(conn)
+        unsynced_students = min(pending["students"], counts.get("students", 0))
+        unsynced_attendance = min(pending["attendance"], counts.get("attendance", 0))
+        today_attendance = conn.execute(TODAY_COUNT, (today,)).fetchone()[0]
+        _, class_attendance, _, _ = attendance_summary(conn, today, today)
+        last_sync = conn.execute("SELECT MAX(sync_timestamp) FROM sync_log").fetchone()[0]
+        return {
+            "student_count": counts.get("students", 0),
+            "today_attendance": today_attendance,
+            "total_records": counts.get("attendance", 0),
+            "class_attendance": class_attendance,
+            "students_synced": counts.get("students", 0) - unsynced_students,
+            "attendance_synced": counts.get("attendance", 0) - unsynced_attendance,
+            "unsynced_students": unsynced_students,
+            "unsynced_attendance": unsynced_attendance,
+            "last_sync": last_sync,
+        }
+
+    def invalidate(self):
+        with self._lock:
+            self.versions = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "day": self.day,
+                "versions": self.versions,
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+            }
+
+
+dashboard_stats = DashboardStats()
@@ -1,22 +1,136 @@
 import sqlite3
 import pickle
+import threading
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash
 import os
 
+from .rollups import ensure_rollups
+from .imports import ensure_import_log
+from .changelog import ensure_change_log
+
 # Use absolute path for database to ensure persistence
 DB_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "instance", "attendance.db"))
 ADMIN_USERNAME = "admin"
 ADMIN_DEFAULT_PASSWORD = "admin"
 
-def get_db_conn():
-    # Add timeout parameter to wait for database lock to be released
-    return sqlite3.connect(DB_PATH, timeout=30)
+INDEXES = [
+    # Makes marking attendance idempotent: a second row for the same student and day is ignored
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_student_day ON attendance (student_id, day)",
+    # Day range reads (counts, joins to students, hourly trends) are answered from the index alone
+    "CREATE INDEX IF NOT EXISTS idx_attendance_day_student ON attendance (day, student_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_students_roll ON students (roll)",
+    # Whole-history exports walk rows in time order without sorting them first
+    "CREATE INDEX IF NOT EXISTS idx_attendance_ts ON attendance (ts)",
+    # The log pages walk history newest first, rows without a ts last
+    "CREATE INDEX IF NOT EXISTS idx_attendance_ts_sort ON attendance (IFNULL(ts, 0))",
+    # The student list pages through names in order, unnamed students first
+    "CREATE INDEX IF NOT EXISTS idx_students_name_sort ON students (IFNULL(name, ''))",
+]
+
+# Connection tuning, set from the app config by configure()
+settings = {
+    "timeout": 30,
+    "synchronous": "NORMAL",
+    "mmap_size": 64 * 1024 * 1024,
+    "cached_statements": 256,
+}
+
+# Connections used outside a request (job threads, scripts), one per thread
+_local = threading.local()
+
+
+class SharedConnection(sqlite3.Connection):
+    """
+    A connection handed out by get_db_conn() and reused for the rest of the
+    request or thread. close() only ends the open transaction, the way a real
+    close would discard it; dispose() really closes.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        super().close()
+
+
+def configure(**options):
+    settings.update(options)
+
+
+def connect(readonly=False):
+    """Open a new tuned connection; readonly ones cannot take the write lock at all."""
+    if readonly:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=settings["timeout"],
+                               cached_statements=settings["cached_statements"], factory=SharedConnection)
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=settings["timeout"],
+                               cached_statements=settings["cached_statements"], factory=SharedConnection)
+    # WAL itself is set once on the database by init_db; these are per connection
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    return conn
+
+
+def get_db_conn(readonly=False):
+    """
+    The connection for the current request (inside a Flask app context) or
+    the current thread (anywhere else), opened on first use.
+
+    With WAL, readonly connections read a consistent snapshot without ever
+    blocking the kiosks' attendance writes.
+    """
+    key = "db_readonly" if readonly else "db"
+    if has_app_context():
+        conn = g.get(key)
+        if conn is None:
+            conn = connect(readonly)
+            setattr(g, key, conn)
+        return conn
+
+    conns = _local.__dict__.setdefault("conns", {})
+    conn = conns.get((DB_PATH, key))
+    if conn is None:
+        conn = conns[(DB_PATH, key)] = connect(readonly)
+    return conn
+
+
+def close_thread_db():
+    """Really close the current thread's connections, e.g. before a process forks its workers."""
+    for conn in _local.__dict__.pop("conns", {}).values():
+        conn.dispose()
+
+
+def close_db(exc=None):
+    """Teardown handler: really close the request's connections."""
+    for key in ("db", "db_readonly"):
+        conn = g.pop(key, None)
+        if conn is not None:
+            conn.dispose()
+
+def get_data_version(conn, name):
+    """Return the change counter for a table, as maintained by the version triggers."""
+    row = conn.execute("SELECT version FROM data_version WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def get_data_versions(conn):
+    """Every table's change counter in one read: {'students': n, 'attendance': n, 'sync_log': n}."""
+    return dict(conn.execute("SELECT name, version FROM data_version").fetchall())
+
+def get_data_counts(conn):
+    """Row counts kept by the count triggers: {'students': n, 'students_synced': n, 'attendance_unsynced': n, ...}."""
+    return dict(conn.execute("SELECT name, value FROM data_counts").fetchall())
 
 def init_db():
     os.makedirs("instance", exist_ok=True)
     conn = get_db_conn()
     c = conn.cursor()
 
+    # Readers and the kiosks' writers no longer block each other
+    c.execute("PRAGMA journal_mode = WAL")
+
     # tables
     c.execute('''CREATE TABLE IF NOT EXISTS students (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -31,7 +145,9 @@ def init_db():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     student_id INTEGER,
                     timestamp TEXT,
-                    synced INTEGER DEFAULT 0
+                    synced INTEGER DEFAULT 0,
+                    day TEXT,
+                    ts INTEGER
                 )''')
     c.execute('''CREATE TABLE IF NOT EXISTS admin (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -43,6 +159,55 @@ def init_db():
                     sync_timestamp TEXT,
                     records_synced INTEGER
                 )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS data_version (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )''')
+    ensure_import_log(c)
+    # Older databases get the day and ts columns, and so these indexes, the rollups and the change log, from
+    # migrate_db.py; the change log must not exist before its duplicate cleanup, or those deletes would be shipped
+    c.execute("PRAGMA table_info(attendance)")
+    if {"day", "ts"} <= {column[1] for column in c.fetchall()}:
+        for statement in INDEXES:
+            c.execute(statement)
+        ensure_rollups(c)
+        # Sequence-numbered change log and per-peer marks for delta sync
+        ensure_change_log(c)
+
+    # Bump a table's version on every change so per-worker caches can tell they are stale
+    for table in ("students", "attendance", "sync_log"):
+        c.execute("INSERT OR IGNORE INTO data_version (name, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                            AFTER {event} ON {table}
+                            BEGIN
+                                UPDATE data_version SET version = version + 1 WHERE name = '{table}';
+                            END''')
+
+    # Row counts, overall and by synced flag, kept by triggers so dashboards never count whole tables
+    c.execute('''CREATE TABLE IF NOT EXISTS data_counts (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )''')
+    for table in ("students", "attendance"):
+        c.execute("SELECT 1 FROM data_counts WHERE name = ?", (table,))
+        if c.fetchone() is None:
+            c.execute(f'''INSERT OR REPLACE INTO data_counts (name, value)
+                            SELECT '{table}', COUNT(*) FROM {table}
+                            UNION ALL SELECT '{table}_synced', COUNT(*) FROM {table} WHERE synced = 1
+                            UNION ALL SELECT '{table}_unsynced', COUNT(*) FROM {table} WHERE synced = 0''')
+        for event, rows, synced in (("INSERT", "1", "(NEW.synced IS {flag})"),
+                                    ("DELETE", "-1", "-(OLD.synced IS {flag})"),
+                                    ("UPDATE OF synced", "0", "(NEW.synced IS {flag}) - (OLD.synced IS {flag})")):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_counts_{event.split()[0].lower()}
+                            AFTER {event} ON {table}
+                            BEGIN
+                                UPDATE data_counts SET value = value + CASE name
+                                    WHEN '{table}' THEN {rows}
+                                    WHEN '{table}_synced' THEN {synced.format(flag=1)}
+                                    ELSE {synced.format(flag=0)} END
+                                WHERE name IN ('{table}', '{table}_synced', '{table}_unsynced');
+                            END''')
 
     # default admin
     c.execute("SELECT * FROM admin WHERE username=?", (ADMIN_USERNAME,))
@@ -52,3 +217,4 @@ def init_db():
 
     conn.commit()
     conn.close()
+
@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+# dlib's HOG detector finds faces down to roughly 80x80 px without upsampling
+HOG_MIN_FACE = 80
+
+# Named speed/accuracy trade-offs. min_face is the smallest face (in full
+# resolution pixels) the profile must find; the frame is downscaled so that
+# face lands at HOG_MIN_FACE. escalate_upsample is only used when the fast
+# pass finds nothing.
+PROFILES = {
+    "fast": {"min_face": 160, "upsample": 0, "escalate_upsample": 1, "num_jitters": 1},
+    "balanced": {"min_face": 100, "upsample": 0, "escalate_upsample": 1, "num_jitters": 1},
+    "accurate": {"min_face": 50, "upsample": 1, "escalate_upsample": 2, "num_jitters": 2},
+}
+DEFAULT_PROFILE = "balanced"
+
+# Width of the grayscale thumbnail the cheap Haar prefilter looks at
+PREFILTER_WIDTH = 160
+PREFILTER_CASCADE = "haarcascade_frontalface_default.xml"
+
+Detection = namedtuple("Detection", ["locations", "encodings", "profile", "escalated", "detect_ms", "encode_ms",
+                                     "prefiltered", "prefilter_ms"])
+
+_stats_lock = threading.Lock()
+profile_stats = {name: {"requests": 0, "escalations": 0, "detect_ms": 0.0, "encode_ms": 0.0} for name in PROFILES}
+prefilter_stats = {"checked": 0, "rejected": 0, "prefilter_ms": 0.0, "saved_ms": 0.0}
+
+# CascadeClassifier objects are not shared between threads
+_local = threading.local()
+
+
+def resolve_profile(name, default=DEFAULT_PROFILE):
+    return name if name in PROFILES else default
+
+
+def locate_faces(rgb, profile_name=DEFAULT_PROFILE):
+    """
+    Find faces on a downscaled copy of the frame and return their boxes in
+    full-resolution coordinates, plus whether the upsampling pass was needed.
+    """
+    import face_recognition
+
+    profile = PROFILES[profile_name]
+    scale = min(1.0, HOG_MIN_FACE / profile["min_face"])
+    small = cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else rgb
+
+    locations = face_recognition.face_locations(small, number_of_times_to_upsample=profile["upsample"])
+    escalated = False
+    if not locations and profile["escalate_upsample"] > profile["upsample"]:
+        locations = face_recognition.face_locations(small, number_of_times_to_upsample=profile["escalate_upsample"])
+        escalated = True
+
+    height, width = rgb.shape[:2]
+    full_locations = [
+        (max(0, int(top / scale)), min(width, int(right / scale)),
+         min(height, int(bottom / scale)), max(0, int(left / scale)))
+        for top, right, bottom, left in locations
+    ]
+    return full_locations, escalated
+
+
+def _cascade():
+    cascade = getattr(_local, "cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + PREFILTER_CASCADE)
+        _local.cascade = cascade
+    return cascade
+
+
+def may_contain_face(rgb):
+    """
+    Cheap Haar cascade pass on a small grayscale thumbnail. It is tuned to be
+    permissive: a False answer means the frame clearly has no face.
+    """
+    cascade = _cascade()
+    if cascade.empty():
+        return True
+
+    height, width = rgb.shape[:2]
+    scale = min(1.0, PREFILTER_WIDTH / width)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.15, minNeighbors=2, minSize=(16, 16))
+    return len(faces) > 0
+
+
+def detect_faces(rgb, profile_name=DEFAULT_PROFILE, prefilter=False):
+    """
+    Detect on a downscaled frame, then encode every face at full resolution.
+
+    With prefilter, frames the Haar gate rejects return no faces without
+    running dlib at all. This may run in a recognition worker process, so it
+    only measures; the caller feeds the result to record_detection().
+    """
+    # Imported here so the web process, which only records results, never loads dlib
+    import face_recognition
+
+    profile_name = resolve_profile(profile_name)
+    prefilter_ms = None
+    if prefilter:
+        start = time.perf_counter()
+        candidate = may_contain_face(rgb)
+        prefilter_ms = (time.perf_counter() - start) * 1000
+        if not candidate:
+            return Detection([], [], profile_name, False, 0.0, 0.0, True, prefilter_ms)
+
+    start = time.perf_counter()
+    locations, escalated = locate_faces(rgb, profile_name)
+    detected = time.perf_counter()
+    encodings = face_recognition.face_encodings(rgb, locations, num_jitters=PROFILES[profile_name]["num_jitters"]) \
+        if locations else []
+    encoded = time.perf_counter()
+
+    return Detection(locations, encodings, profile_name, escalated,
+                     (detected - start) * 1000, (encoded - detected) * 1000, False, prefilter_ms)
+
+
+def encode_faces(rgb, locations, profile_name=DEFAULT_PROFILE):
+    """
+    Encode the faces at known boxes without detecting again, for a frame
+    whose boxes came from the frame cache. The encodings always come from
+    this frame, so a different face at the same spot is matched as itself.
+    """
+    import face_recognition
+
+    profile_name = resolve_profile(profile_name)
+    start = time.perf_counter()
+    encodings = face_recognition.face_encodings(rgb, locations, num_jitters=PROFILES[profile_name]["num_jitters"]) \
+        if locations else []
+    encoded = time.perf_counter()
+    return Detection(locations, encodings, profile_name, False, 0.0, (encoded - start) * 1000, False, None)
+
+
+def detect_new_faces(rgb, profile_name, known_boxes, iou_threshold):
+    """
+    Detect every face but only encode the ones that do not overlap a known
+    box, i.e. faces a stream has not identified yet. Encodings line up with
+    locations and are None for the faces that were skipped.
+    """
+    import face_recognition
+    from .tracking import associate
+
+    profile_name = resolve_profile(profile_name)
+    start = time.perf_counter()
+    locations, escalated = locate_faces(rgb, profile_name)
+    detected = time.perf_counter()
+
+    known = associate(locations, known_boxes, iou_threshold)
+    new_locations = [location for location, match in zip(locations, known) if match is None]
+    new_encodings = iter(face_recognition.face_encodings(
+        rgb, new_locations, num_jitters=PROFILES[profile_name]["num_jitters"]) if new_locations else [])
+    encodings = [next(new_encodings) if match is None else None for match in known]
+    encoded = time.perf_counter()
+
+    return Detection(locations, encodings, profile_name, escalated,
+                     (detected - start) * 1000, (encoded - detected) * 1000, False, None)
+
+
+def record_detection(detection):
+    """Add one detection's timings to this process's metrics."""
+    with _stats_lock:
+        stats = profile_stats[detection.profile]
+        if detection.prefilter_ms is not None:
+            prefilter_stats["checked"] += 1
+            prefilter_stats["prefilter_ms"] += detection.prefilter_ms
+        if detection.prefiltered:
+            # What the skipped dlib pass would have cost, on this profile's average
+            prefilter_stats["rejected"] += 1
+            prefilter_stats["saved_ms"] += stats["detect_ms"] / stats["requests"] if stats["requests"] else 0.0
+            return
+        stats["requests"] += 1
+        stats["escalations"] += int(detection.escalated)
+        stats["detect_ms"] += detection.detect_ms
+        stats["encode_ms"] += detection.encode_ms
+
+
+def stats():
+    with _stats_lock:
+        result = {}
+        for name, stats in profile_stats.items():
+            requests = stats["requests"]
+            result[name] = {
+                "requests": requests,
+                "escalations": stats["escalations"],
+                "avg_detect_ms": round(stats["detect_ms"] / requests, 2) if requests else None,
+                "avg_encode_ms": round(stats["encode_ms"] / requests, 2) if requests else None,
+            }
+        checked = prefilter_stats["checked"]
+        result["prefilter"] = {
+            "checked": checked,
+            "rejected": prefilter_stats["rejected"],
+            "rejection_rate": round(prefilter_stats["rejected"] / checked, 4) if checked else None,
+            "avg_prefilter_ms": round(prefilter_stats["prefilter_ms"] / checked, 2) if checked else None,
+            "saved_ms": round(prefilter_stats["saved_ms"], 2),
+            # Time the gate itself cost on every frame it checked
+            "net_saved_ms": round(prefilter_stats["saved_ms"] - prefilter_stats["prefilter_ms"], 2),
+        }
+    return result
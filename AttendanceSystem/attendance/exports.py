@@ -0,0 +1,149 @@
+import csv
+import io
+import threading
+import time
+import zlib
+
+from flask import Response, current_app, request, stream_with_context
+
+from .admission import _histogram, _labelled, _observe
+from .columnar import DEFAULT_BLOCK_ROWS, EXPORT_QUERY, columnar_chunks
+
+DEFAULT_BATCH_SIZE = 1000
+# wbits for a gzip wrapper (header and trailer) around the deflate stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+FIRST_BYTE_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class ExportStats:
+    """Time to first byte, duration and size of the exports served by this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats_counters = {"exports": 0, "csv": 0, "columnar": 0, "gzipped": 0, "rows": 0, "bytes": 0,
+                               "aborted": 0}
+        self.first_byte_histogram = _histogram(FIRST_BYTE_BUCKETS_MS)
+        self.last = None
+
+    def record(self, fmt, first_byte_ms, total_ms, rows, size, gzipped, finished):
+        with self._lock:
+            self.stats_counters["exports"] += 1
+            self.stats_counters[fmt] += 1
+            self.stats_counters["gzipped"] += gzipped
+            self.stats_counters["rows"] += rows
+            self.stats_counters["bytes"] += size
+            self.stats_counters["aborted"] += not finished
+            if first_byte_ms is not None:
+                _observe(self.first_byte_histogram, FIRST_BYTE_BUCKETS_MS, first_byte_ms)
+            self.last = {"format": fmt, "first_byte_ms": first_byte_ms, "total_ms": round(total_ms, 2), "rows": rows,
+                         "bytes": size, "gzipped": gzipped}
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result.update({
+                "last": self.last,
+                "first_byte_ms_histogram": _labelled(self.first_byte_histogram, FIRST_BYTE_BUCKETS_MS),
+            })
+        return result
+
+
+export_stats = ExportStats()
+
+
+def csv_chunks(cursor, header, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield (CSV text, row count) for a query's result, one chunk per fetchmany
+    batch, so no more than batch_size rows are held at once. The header goes
+    out first, before the first batch is fetched.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue(), 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue(), len(rows)
+
+
+def gzip_chunks(chunks):
+    """
+    Compress a stream of byte chunks into one gzip stream. Every chunk is
+    sync-flushed, so compressed output leaves with each batch instead of
+    waiting for zlib's internal buffer to fill.
+    """
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def wants_gzip():
+    """Gzip the export when the client accepts it, unless EXPORT_GZIP is off."""
+    return current_app.config['EXPORT_GZIP'] and "gzip" in request.accept_encodings
+
+
+def _stream_download(conn, produce, mimetype, filename, fmt, gzip=False):
+    """
+    A download response whose body is produce(progress)'s byte chunks.
+
+    Everything runs inside the response generator, so the headers reach the
+    client before SQLite has produced a single row. With gzip the body is
+    compressed on the fly. conn is closed when the stream ends, including
+    when the client disconnects half way.
+    """
+    started = time.perf_counter()
+    progress = {"rows": 0, "bytes": 0, "first_byte_ms": None}
+
+    def body():
+        finished = False
+        try:
+            for data in (gzip_chunks(produce(progress)) if gzip else produce(progress)):
+                if not data:
+                    continue
+                if progress["first_byte_ms"] is None:
+                    progress["first_byte_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                progress["bytes"] += len(data)
+                yield data
+            finished = True
+        finally:
+            conn.close()
+            export_stats.record(fmt, progress["first_byte_ms"], (time.perf_counter() - started) * 1000,
+                                progress["rows"], progress["bytes"], gzip, finished)
+
+    response = Response(stream_with_context(body()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["Vary"] = "Accept-Encoding"
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def stream_csv(conn, query, params, header, filename, gzip=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    A response that streams query's rows as a CSV download. The CSV header
+    row goes out before the first batch is fetched, and memory stays bounded
+    by one batch whatever the range.
+    """
+    def produce(progress):
+        cursor = conn.execute(query, params)
+        for chunk, rows in csv_chunks(cursor, header, batch_size):
+            progress["rows"] += rows
+            yield chunk.encode("utf-8")
+
+    return _stream_download(conn, produce, "text/csv", filename, "csv", gzip)
+
+
+def stream_columnar(conn, start_date, end_date, filename, block_rows=DEFAULT_BLOCK_ROWS):
+    """A response that streams a date range as a columnar export; its blocks are compressed already."""
+    def produce(progress):
+        cursor = conn.execute(EXPORT_QUERY, (start_date, end_date))
+        yield from columnar_chunks(cursor, block_rows, progress)
+
+    return _stream_download(conn, produce, "application/octet-stream", filename, "columnar")
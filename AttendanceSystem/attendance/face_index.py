@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from .matching import ENCODING_SIZE, face_distances, nearest
+
+# Below this many enrolled faces an exact scan is already fast enough
+DEFAULT_ANN_THRESHOLD = 5000
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 12
+# k-means is trained on at most this many points per partition
+KMEANS_SAMPLE_PER_LIST = 64
+
+# Counters shared by every index this worker builds
+index_stats = {
+    "builds": 0,
+    "loads": 0,
+    "last_build_ms": None,
+    "searches": 0,
+    "recall_checks": 0,
+    "recall_hits": 0,
+}
+_stats_lock = threading.Lock()
+
+
+class ExactIndex:
+    """Brute-force search over the whole gallery."""
+
+    kind = "exact"
+
+    def __init__(self, encodings):
+        self.encodings = encodings
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def search(self, probes, k=2):
+        with _stats_lock:
+            index_stats["searches"] += 1
+        return nearest(face_distances(probes, self.encodings), k)
+
+    def patched(self, keep, added, encodings):
+        return ExactIndex(encodings)
+
+    def needs_rebuild(self, settings):
+        return len(self) >= settings["threshold"]
+
+
+class IVFIndex:
+    """
+    Inverted-file index: encodings are partitioned around k-means centroids
+    and a query only scans the nprobe partitions closest to it.
+
+    Partition assignments line up with the gallery rows, so adding or
+    removing a student only appends or drops entries of that array.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, encodings, centroids, assignments, nprobe, trained_size):
+        self.encodings = encodings
+        self.centroids = centroids
+        self.assignments = assignments
+        self.nprobe = nprobe
+        self.trained_size = trained_size
+        self.recall_sample_every = 0
+        # Rows grouped by partition, so each list is one contiguous slice
+        self._order = np.argsort(assignments, kind="stable")
+        self._sorted = encodings[self._order]
+        self._bounds = np.searchsorted(assignments[self._order], np.arange(len(centroids) + 1))
+
+    def __len__(self):
+        return len(self.encodings)
+
+    @classmethod
+    def train(cls, encodings, nprobe, seed=0):
+        nlist = max(1, int(np.sqrt(len(encodings))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(encodings), nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = encodings[rng.choice(len(encodings), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = face_distances(sample, centroids).argmin(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            filled = counts > 0
+            # Empty partitions keep their previous centroid
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        return cls.from_centroids(encodings, centroids, nprobe, trained_size=len(encodings))
+
+    @classmethod
+    def from_centroids(cls, encodings, centroids, nprobe, trained_size):
+        return cls(encodings, centroids, assign(encodings, centroids), nprobe, trained_size)
+
+    def search(self, probes, k=2):
+        probes = np.asarray(probes, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe_lists = np.argpartition(face_distances(probes, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+
+        rows = np.full((len(probes), k), -1, dtype=np.int64)
+        distances = np.full((len(probes), k), np.inf)
+        for i, lists in enumerate(probe_lists):
+            slices = [slice(self._bounds[l], self._bounds[l + 1]) for l in lists]
+            candidates = np.concatenate([self._order[part] for part in slices])
+            if len(candidates) == 0:
+                continue
+            found, found_distances = nearest(
+                np.concatenate([face_distances(probes[i], self._sorted[part]) for part in slices], axis=1), k)
+            rows[i, :found.shape[1]] = candidates[found[0]]
+            distances[i, :found.shape[1]] = found_distances[0]
+
+        with _stats_lock:
+            index_stats["searches"] += 1
+            check_recall = self.recall_sample_every and index_stats["searches"] % self.recall_sample_every == 0
+        if check_recall:
+            self._check_recall(probes, rows)
+        return rows, distances
+
+    def _check_recall(self, probes, rows):
+        exact_rows, _ = nearest(face_distances(probes, self.encodings), k=1)
+        hits = int((exact_rows[:, 0] == rows[:, 0]).sum())
+        with _stats_lock:
+            index_stats["recall_checks"] += len(probes)
+            index_stats["recall_hits"] += hits
+
+    def patched(self, keep, added, encodings):
+        assignments = np.concatenate([self.assignments[keep], assign(added, self.centroids)])
+        index = IVFIndex(encodings, self.centroids, assignments, self.nprobe, self.trained_size)
+        index.recall_sample_every = self.recall_sample_every
+        return index
+
+    def needs_rebuild(self, settings):
+        # Centroids drift once the gallery has changed size a lot since training
+        return len(self) < settings["threshold"] or len(self) > 2 * self.trained_size
+
+
+def assign(encodings, centroids):
+    if len(encodings) == 0:
+        return np.empty(0, dtype=np.int64)
+    return face_distances(encodings, centroids).argmin(axis=1)
+
+
+def build_index(encodings, ids, version, settings):
+    """Pick and build the index for a gallery, reusing the persisted one when possible."""
+    if len(encodings) < settings["threshold"]:
+        return ExactIndex(encodings)
+
+    start = time.perf_counter()
+    index = load_index(settings["path"], encodings, ids, version, settings)
+    if index is None:
+        index = IVFIndex.train(encodings, settings["nprobe"])
+        save_index(settings["path"], index, ids, version)
+        with _stats_lock:
+            index_stats["builds"] += 1
+            index_stats["last_build_ms"] = (time.perf_counter() - start) * 1000
+    else:
+        with _stats_lock:
+            index_stats["loads"] += 1
+    index.recall_sample_every = settings["recall_sample_every"]
+    return index
+
+
+def load_index(path, encodings, ids, version, settings):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            trained_size = int(data["trained_size"])
+            # Same roster as when it was saved: reuse the assignments as-is
+            if int(data["version"]) == version and np.array_equal(data["ids"], ids):
+                return IVFIndex(encodings, centroids, data["assignments"], settings["nprobe"], trained_size)
+    except (OSError, KeyError, ValueError):
+        return None
+
+    # Roster changed since then: keep the trained centroids, only reassign rows
+    if len(encodings) > 2 * trained_size:
+        return None
+    return IVFIndex.from_centroids(encodings, centroids, settings["nprobe"], trained_size)
+
+
+def save_index(path, index, ids, version):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, centroids=index.centroids, assignments=index.assignments, ids=ids,
+             version=version, trained_size=index.trained_size)
+    # Atomic rename so other workers never read a half-written file
+    os.replace(tmp_path, path)
+
+
+def stats():
+    with _stats_lock:
+        result = dict(index_stats)
+    checks = result["recall_checks"]
+    result["recall"] = round(result["recall_hits"] / checks, 4) if checks else None
+    if result["last_build_ms"] is not None:
+        result["last_build_ms"] = round(result["last_build_ms"], 2)
+    return result
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 256
+# Kept short: boxes of a frame a few seconds old are unlikely to fit a new one
+DEFAULT_TTL = 3.0
+# Frames whose 64-bit hashes differ in at most this many bits count as the same picture
+DEFAULT_MAX_DISTANCE = 2
+# dHash compares neighbouring pixels of a (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail
+HASH_SIZE = 8
+
+
+def frame_hash(image_bytes):
+    """
+    Difference hash of an encoded frame, or None if it cannot be decoded.
+    The JPEG is decoded at 1/8 scale straight to grayscale, which costs a
+    fraction of a full decode.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    thumb = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class FrameCache:
+    """
+    Short-lived LRU cache of detected face boxes keyed by perceptual frame hash.
+
+    Entries live in a partition (kiosk, scan options) and a lookup only ever
+    looks inside its own partition, so results never cross kiosks. A hit is
+    only a detection hint: the whole-frame hash cannot tell two students at
+    the same spot apart, so the faces are encoded again from the new frame
+    and matching and marking always run again.
+
+    A lookup only compares the hashes of its own partition and drops the
+    expired ones it meets there; entries of kiosks that went quiet leave by
+    LRU eviction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (partition, hash) -> (value, expires), least recently used first
+        self._entries = OrderedDict()
+        # partition -> the hashes it holds
+        self._partitions = {}
+        self.max_entries = DEFAULT_MAX_ENTRIES
+        self.ttl = DEFAULT_TTL
+        self.max_distance = DEFAULT_MAX_DISTANCE
+        self.stats_counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def configure(self, max_entries=None, ttl=None, max_distance=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if ttl is not None:
+                self.ttl = ttl
+            if max_distance is not None:
+                self.max_distance = max_distance
+            self._entries.clear()
+            self._partitions.clear()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _drop(self, key):
+        hashes = self._partitions[key[0]]
+        hashes.discard(key[1])
+        if not hashes:
+            del self._partitions[key[0]]
+
+    def get(self, partition, frame_hash):
+        with self._lock:
+            now = time.monotonic()
+            best_key, best_distance = None, None
+            for cached_hash in list(self._partitions.get(partition, ())):
+                key = (partition, cached_hash)
+                if self._entries[key][1] <= now:
+                    del self._entries[key]
+                    self._drop(key)
+                    self.stats_counters["expired"] += 1
+                    continue
+                distance = bin(cached_hash ^ frame_hash).count("1")
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self.stats_counters["misses"] += 1
+                return None
+            self.stats_counters["hits"] += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][0]
+
+    def put(self, partition, frame_hash, value):
+        with self._lock:
+            key = (partition, frame_hash)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._partitions.setdefault(partition, set()).add(frame_hash)
+            while len(self._entries) > self.max_entries:
+                self._drop(self._entries.popitem(last=False)[0])
+                self.stats_counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            lookups = result["hits"] + result["misses"]
+            result.update({
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_rate": round(result["hits"] / lookups, 4) if lookups else None,
+            })
+        return result
+
+
+frame_cache = FrameCache()
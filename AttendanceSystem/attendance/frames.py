@@ -0,0 +1,112 @@
+import base64
+import binascii
+import threading
+
+import cv2
+import numpy as np
+
+# Content types accepted as a raw image body
+RAW_IMAGE_TYPES = {"image/jpeg", "image/png", "application/octet-stream"}
+DEFAULT_MAX_FRAME_BYTES = 10 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+# Each request thread keeps one growable upload buffer instead of allocating per frame
+_local = threading.local()
+
+
+class FrameError(ValueError):
+    """The request did not carry a usable image."""
+
+
+def _buffer(size):
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(max(size, READ_CHUNK))
+        _local.buffer = buffer
+    return buffer
+
+
+def _grow(buffer, size):
+    grown = bytearray(size)
+    grown[:len(buffer)] = buffer
+    _local.buffer = grown
+    return grown
+
+
+def _read_stream(stream, length, max_bytes):
+    """Read a whole stream into the thread's buffer and return a view of the filled part."""
+    if length is not None and length > max_bytes:
+        raise FrameError("Image is too large")
+
+    buffer = _buffer(length or READ_CHUNK)
+    readinto = getattr(stream, "readinto", None)
+    filled = 0
+    while length is None or filled < length:
+        if filled == len(buffer):
+            if filled >= max_bytes:
+                raise FrameError("Image is too large")
+            buffer = _grow(buffer, min(2 * len(buffer), max_bytes))
+        end = length if length is not None else len(buffer)
+        with memoryview(buffer) as view:
+            if readinto is not None:
+                count = readinto(view[filled:end])
+            else:
+                chunk = stream.read(end - filled)
+                count = len(chunk)
+                view[filled:filled + count] = chunk
+        if not count:
+            break
+        filled += count
+        if filled > max_bytes:
+            raise FrameError("Image is too large")
+    return memoryview(buffer)[:filled]
+
+
+def read_frame_bytes(req, field="image", max_bytes=DEFAULT_MAX_FRAME_BYTES):
+    """
+    Return the uploaded image from a request, whichever way the client sent it:
+    a raw image/jpeg body, a multipart file field, or the legacy base64 data
+    URL inside a JSON body.
+
+    Raw and multipart uploads are read straight into a per-thread buffer; the
+    returned memoryview is only valid until the same thread reads another frame.
+    """
+    if req.mimetype in RAW_IMAGE_TYPES:
+        return _read_stream(req.stream, req.content_length, max_bytes)
+
+    upload = req.files.get(field)
+    if upload is not None and upload.filename != "":
+        return _read_stream(upload.stream, None, max_bytes)
+
+    data = req.get_json(silent=True)
+    if isinstance(data, dict) and data.get(field):
+        image_data = data[field]
+        if not isinstance(image_data, str):
+            raise FrameError("Image data must be a base64 string")
+        if image_data.startswith("data:"):
+            image_data = image_data.split(",", 1)[-1]
+        try:
+            return memoryview(base64.b64decode(image_data))
+        except (binascii.Error, ValueError):
+            raise FrameError("Image data is not valid base64")
+
+    raise FrameError("No image data provided")
+
+
+def request_params(req, exclude=("image",)):
+    """Scan options from the query string, form fields and JSON body; a later source overrides an earlier one."""
+    params = req.args.to_dict()
+    params.update(req.form.to_dict())
+    data = req.get_json(silent=True)
+    if isinstance(data, dict):
+        params.update({key: value for key, value in data.items() if key not in exclude})
+    return params
+
+
+def decode_frame(image_bytes):
+    """Decode JPEG/PNG bytes into the RGB frame face_recognition expects."""
+    frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise FrameError("Could not decode image")
+    # OpenCV decodes to BGR; dlib's models were trained on RGB
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from . import face_index
+from .db import DB_PATH, get_data_version
+from .matching import ENCODING_SIZE
+
+ENCODING_BYTES = ENCODING_SIZE * np.dtype(np.float64).itemsize
+
+# One immutable view of the enrolled students; rows of every array line up
+GallerySnapshot = namedtuple(
+    "GallerySnapshot",
+    ["encodings", "ids", "names", "rolls", "classes", "sections", "index", "version"],
+)
+
+# Columns that are patched together when one student changes
+ROW_FIELDS = 6
+
+STUDENT_COLUMNS = "id, name, roll, class, section, face_encoding"
+
+
+def _build_snapshot(rows, version, settings=None):
+    rows = [row for row in rows if row[5] is not None and len(row[5]) == ENCODING_BYTES]
+    if rows:
+        encodings = np.frombuffer(b"".join(row[5] for row in rows), dtype=np.float64)
+        encodings = encodings.reshape(len(rows), ENCODING_SIZE)
+    else:
+        encodings = np.empty((0, ENCODING_SIZE), dtype=np.float64)
+
+    snapshot = GallerySnapshot(
+        encodings=encodings,
+        ids=np.array([row[0] for row in rows], dtype=np.int64),
+        names=np.array([row[1] or "" for row in rows], dtype=object),
+        rolls=np.array([row[2] or "" for row in rows], dtype=object),
+        classes=np.array([row[3] or "" for row in rows], dtype=object),
+        sections=np.array([row[4] or "" for row in rows], dtype=object),
+        index=None,
+        version=version,
+    )
+    if settings is None:
+        return snapshot
+    return snapshot._replace(index=face_index.build_index(snapshot.encodings, snapshot.ids, version, settings))
+
+
+def resolve_scope(class_name=None, section=None, room=None, rooms=None):
+    """
+    Turn scan parameters into a frozenset of (class, section) pairs.
+
+    A room names a list of [class, section] pairs from KIOSK_ROOMS; an empty
+    section covers the whole class. Returns None for the full gallery.
+    """
+    if room:
+        if not rooms or room not in rooms:
+            raise ValueError(f"Unknown room: {room}")
+        return frozenset((str(pair[0]), str(pair[1]) if len(pair) > 1 else "") for pair in rooms[room])
+    if class_name:
+        return frozenset([(class_name, section or "")])
+    return None
+
+
+class FaceGallery:
+    """
+    Per-worker cache of every enrolled face encoding.
+
+    The students table carries a version counter bumped by triggers, so a
+    single cheap lookup per request tells us whether another worker changed
+    the roster. Writes made by this worker patch the snapshot in place.
+
+    Snapshots and their indexes are built outside the lock, which is only
+    held to look up or swap in a snapshot, so a k-means training run never
+    stalls the scans of the current roster.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # One reload at a time: scans that miss together wait for the same build instead of each training one
+        self._reload_lock = threading.Lock()
+        self._snapshot = None
+        # Sub-galleries keyed by (version, scope); rebuilt lazily after any change
+        self._scopes = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.patches = 0
+        self.scope_hits = 0
+        self.scope_builds = 0
+        self.last_reload_ms = None
+        self.settings = {
+            "threshold": face_index.DEFAULT_ANN_THRESHOLD,
+            "nprobe": face_index.DEFAULT_NPROBE,
+            "recall_sample_every": 0,
+            "path": os.path.join(os.path.dirname(DB_PATH), "face_index.npz"),
+        }
+
+    def configure(self, **settings):
+        with self._lock:
+            self.settings.update(settings)
+            self._snapshot = None
+
+    def _current(self, version):
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+        return None
+
+    def get(self, conn):
+        version = get_data_version(conn, "students")
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+
+        with self._reload_lock:
+            # Another scan may have loaded this version while we waited
+            return self._current(version) or self._reload(conn, version)
+
+    def get_scoped(self, conn, scope):
+        """Return the sub-gallery holding only the students of the given class/section pairs."""
+        snapshot = self.get(conn)
+        if not scope:
+            return snapshot
+
+        key = (snapshot.version, scope)
+        with self._lock:
+            scoped = self._scopes.get(key)
+            if scoped is not None:
+                self.scope_hits += 1
+                return scoped
+            # Sub-galleries are cheap to rebuild, so they are never persisted
+            settings = dict(self.settings, path=None)
+
+        # Built outside the lock, so one room training its index does not stall every other scan
+        mask = np.zeros(len(snapshot.ids), dtype=bool)
+        for class_name, section in scope:
+            part = snapshot.classes == class_name
+            if section:
+                part &= snapshot.sections == section
+            mask |= part
+        columns = [column[mask] for column in snapshot[:ROW_FIELDS]]
+        index = face_index.build_index(columns[0], columns[1], snapshot.version, settings)
+        scoped = GallerySnapshot(*columns, index=index, version=snapshot.version)
+
+        with self._lock:
+            self.scope_builds += 1
+            # A concurrent scan of the same scope may have installed its build first; keep that one
+            installed = self._scopes.get(key)
+            if installed is not None:
+                return installed
+            # Only cached while its version is current; the caller still gets it, matching the snapshot it read
+            current = self._snapshot
+            if current is not None and current.version == snapshot.version:
+                self._scopes = {k: v for k, v in self._scopes.items() if k[0] == snapshot.version}
+                self._scopes[key] = scoped
+            return scoped
+
+    def _reload(self, conn, version):
+        start = time.perf_counter()
+        with self._lock:
+            settings = dict(self.settings)
+        rows = conn.execute(f"SELECT {STUDENT_COLUMNS} FROM students ORDER BY id").fetchall()
+        snapshot = _build_snapshot(rows, version, settings)
+
+        with self._lock:
+            # A patch from this worker's own write may have moved past the version we read; keep the newer one
+            current = self._snapshot
+            if current is None or current.version < version:
+                self._snapshot = snapshot
+            self.reloads += 1
+            self.last_reload_ms = (time.perf_counter() - start) * 1000
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def upsert(self, conn, student_id):
+        """Refresh one student after an insert or update has been committed on conn."""
+        version = get_data_version(conn, "students")
+        row = conn.execute(f"SELECT {STUDENT_COLUMNS} FROM students WHERE id = ?", (student_id,)).fetchone()
+        snapshot = self._patch_base(version)
+        if snapshot is None:
+            return
+        keep = snapshot.ids != student_id
+        added = _build_snapshot([row] if row else [], version)
+        columns = [np.concatenate([column[keep], new])
+                   for column, new in zip(snapshot[:ROW_FIELDS], added[:ROW_FIELDS])]
+        index = snapshot.index.patched(keep, added.encodings, columns[0])
+        self._replace_snapshot(snapshot, GallerySnapshot(*columns, index=index, version=version))
+
+    def remove(self, conn, student_id):
+        """Drop one student after a delete has been committed on conn."""
+        version = get_data_version(conn, "students")
+        snapshot = self._patch_base(version)
+        if snapshot is None:
+            return
+        keep = snapshot.ids != student_id
+        columns = [column[keep] for column in snapshot[:ROW_FIELDS]]
+        index = snapshot.index.patched(keep, columns[0][:0], columns[0])
+        self._replace_snapshot(snapshot, GallerySnapshot(*columns, index=index, version=version))
+
+    def _patch_base(self, version):
+        """The snapshot a write that produced version patches, or None (and a dropped cache) if it missed changes."""
+        with self._lock:
+            snapshot = self._snapshot
+            # Anything other than exactly our own write means the cache missed other changes
+            if snapshot is None or snapshot.version != version - 1:
+                self._snapshot = None
+                return None
+            return snapshot
+
+    def _replace_snapshot(self, base, snapshot):
+        with self._lock:
+            settings = dict(self.settings)
+        if snapshot.index.needs_rebuild(settings):
+            snapshot = snapshot._replace(index=face_index.build_index(
+                snapshot.encodings, snapshot.ids, snapshot.version, settings))
+        with self._lock:
+            # Installed only on top of the snapshot it patched; a concurrent change means a reload instead
+            self._snapshot = snapshot if self._snapshot is base else None
+            self.patches += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        snapshot = self._snapshot
+        return {
+            "size": len(snapshot.ids) if snapshot is not None else 0,
+            "version": snapshot.version if snapshot is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "reloads": self.reloads,
+            "patches": self.patches,
+            "last_reload_ms": round(self.last_reload_ms, 2) if self.last_reload_ms is not None else None,
+            "index": snapshot.index.kind if snapshot is not None else None,
+            "scopes": len(self._scopes),
+            "scope_hits": self.scope_hits,
+            "scope_builds": self.scope_builds,
+        }
+
+
+gallery = FaceGallery()
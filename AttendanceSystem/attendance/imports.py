@@ -0,0 +1,227 @@
+import datetime
+import itertools
+import json
+import threading
+import time
+
+DEFAULT_BATCH_SIZE = 1000
+
+# One row per committed import batch, so a retried upload with the same idempotency key is not applied twice
+IMPORT_LOG_TABLE = '''CREATE TABLE IF NOT EXISTS import_batches (
+                        key TEXT PRIMARY KEY,
+                        records INTEGER NOT NULL,
+                        imported INTEGER NOT NULL,
+                        students_created INTEGER NOT NULL,
+                        imported_at TEXT NOT NULL
+                    )'''
+
+# Every roll of a batch in one statement, through the roll index; MIN(id) picks the oldest of duplicate rolls
+RESOLVE_ROLLS = """
+    SELECT roll, MIN(id) FROM students
+    WHERE roll IN (SELECT value FROM json_each(?))
+    GROUP BY roll
+"""
+
+
+class RecordError(ValueError):
+    """A record of an import body that cannot be imported; line is its 1-based position."""
+
+    def __init__(self, line, message):
+        super().__init__(f"Record {line}: {message}")
+        self.line = line
+
+
+class ImportStats:
+    """Batches, records and throughput of the imports served by this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats_counters = {"imports": 0, "batches": 0, "replayed_batches": 0, "records": 0, "imported": 0,
+                               "students_created": 0, "failed": 0}
+        self.last = None
+
+    def record(self, progress, seconds, failed):
+        with self._lock:
+            self.stats_counters["imports"] += 1
+            self.stats_counters["failed"] += failed
+            for name in ("batches", "replayed_batches", "records", "imported", "students_created"):
+                self.stats_counters[name] += progress[name]
+            self.last = {"records": progress["records"], "seconds": round(seconds, 3),
+                         "records_per_second": progress.get("records_per_second")}
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result["last"] = self.last
+        return result
+
+
+import_stats = ImportStats()
+
+
+def ensure_import_log(cursor):
+    cursor.execute(IMPORT_LOG_TABLE)
+
+
+def _record(record, line):
+    """The (roll, name, class, section, timestamp) of one import record."""
+    if not isinstance(record, dict):
+        raise RecordError(line, "expected a JSON object")
+    for field in ("roll", "timestamp"):
+        if record.get(field) in (None, ""):
+            raise RecordError(line, f"missing {field}")
+    return (str(record["roll"]), record.get("name"), record.get("class"), record.get("section"),
+            record["timestamp"])
+
+
+def parse_ndjson(stream):
+    """
+    Yield the (line, record) pairs of a newline-delimited JSON body one line
+    at a time; blank lines are skipped but still counted.
+    """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError:
+            raise RecordError(line, "invalid JSON")
+
+
+def _read(records, count):
+    """The next count (line, row) pairs of validated records, or fewer at the end."""
+    return [(line, _record(record, line)) for line, record in itertools.islice(records, count)]
+
+
+def check_timestamps(conn, batch, lines):
+    """
+    Raise RecordError for the first row whose timestamp SQLite cannot read.
+    Its day would be NULL, which the (student_id, day) unique index never
+    treats as a duplicate, so a retried upload would add the row again.
+    """
+    # One statement for the whole batch, with SQLite's own date parser
+    bad = conn.execute("""SELECT MIN(key) FROM json_each(?)
+                          WHERE date(value) IS NULL OR strftime('%s', value, 'utc') IS NULL""",
+                       (json.dumps([row[4] for row in batch]),)).fetchone()[0]
+    if bad is not None:
+        raise RecordError(lines[bad], f"invalid timestamp {batch[bad][4]!r}")
+
+
+def _logged_records(conn, key):
+    row = conn.execute("SELECT records FROM import_batches WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def resolve_rolls(conn, rolls):
+    """{roll: student id} for the rolls that have a student, in one indexed query."""
+    return dict(conn.execute(RESOLVE_ROLLS, (json.dumps(list(rolls)),)).fetchall())
+
+
+def import_batch(conn, batch, key=None, lines=None):
+    """
+    Import one batch of (roll, name, class, section, timestamp) rows in one
+    transaction: resolve every roll at once, create the missing students
+    with one executemany, then insert the attendance, ignoring rows for a
+    student and day that already exist.
+
+    A batch whose key was imported before, or is committed by a concurrent
+    upload first, is skipped; its "records" is then the number of records
+    that earlier batch covered, which may differ from this one's. A batch
+    with an unreadable timestamp raises RecordError, naming the row's entry
+    of lines (1-based positions by default), before anything is written.
+    Returns {"records", "imported", "students_created", "replayed"}.
+    """
+    replayed = {"imported": 0, "students_created": 0, "replayed": True}
+    if key is not None:
+        records = _logged_records(conn, key)
+        if records is not None:
+            return dict(replayed, records=records)
+    check_timestamps(conn, batch, lines or range(1, len(batch) + 1))
+
+    c = conn.cursor()
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        if key is not None:
+            # Claimed first, under the write lock: a concurrent upload with the same key either sees this row
+            # or finds its own claim ignored and rolls back as a replay
+            c.execute("""INSERT OR IGNORE INTO import_batches (key, records, imported, students_created, imported_at)
+                         VALUES (?, ?, 0, 0, ?)""", (key, len(batch), datetime.datetime.now().isoformat()))
+            if c.rowcount == 0:
+                conn.rollback()
+                return dict(replayed, records=_logged_records(conn, key))
+
+        # The first record of a roll names the student, as the old per-record loop did
+        rows_by_roll = {}
+        for row in batch:
+            rows_by_roll.setdefault(row[0], row)
+        ids = resolve_rolls(conn, rows_by_roll)
+        missing = [rows_by_roll[roll][:4] for roll in rows_by_roll if roll not in ids]
+        if missing:
+            c.executemany("INSERT INTO students (roll, name, class, section) VALUES (?, ?, ?, ?)", missing)
+            ids.update(resolve_rolls(conn, (row[0] for row in missing)))
+
+        c.executemany("""
+            INSERT OR IGNORE INTO attendance (student_id, timestamp, day, ts)
+            VALUES (?, ?, date(?), strftime('%s', ?, 'utc'))
+        """, ((ids[row[0]], row[4], row[4], row[4]) for row in batch))
+        imported = c.rowcount
+
+        if key is not None:
+            c.execute("UPDATE import_batches SET imported = ?, students_created = ? WHERE key = ?",
+                      (imported, len(missing), key))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"records": len(batch), "imported": imported, "students_created": len(missing), "replayed": False}
+
+
+def run_import(conn, records, key=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Import an iterable of (line, record dict) pairs, batch_size at a time,
+    and return the totals with the throughput in records per second. line
+    is what a RecordError reports: parse_ndjson() yields the body's lines,
+    enumerate(records, 1) numbers a JSON array.
+
+    Each batch commits on its own and is read in full before its transaction
+    starts, so a streamed upload never holds the write lock while waiting on
+    the network. With a key, the batch starting at record offset n is logged
+    as "<key>:<n>": retrying a failed or repeated upload under the same key
+    skips the records already committed and resumes after them, even if the
+    batch size changed in between. progress (a dict) is updated as batches
+    commit, so a caller still has the totals when a later batch fails.
+    """
+    progress = progress if progress is not None else {}
+    progress.update({"records": 0, "imported": 0, "duplicates": 0, "students_created": 0, "batches": 0,
+                     "replayed_batches": 0})
+    started = time.perf_counter()
+    failed = True
+    try:
+        records = iter(records)
+        pending, offset = [], 0
+        while True:
+            pending += _read(records, batch_size - len(pending))
+            if not pending:
+                break
+            result = import_batch(conn, [row for _, row in pending], None if key is None else f"{key}:{offset}",
+                                  [line for line, _ in pending])
+            # A replayed batch covered as many records as its first attempt did, which may be more or fewer
+            consumed = result["records"]
+            for _ in itertools.islice(records, max(0, consumed - len(pending))):
+                pass
+            pending = pending[consumed:]
+            offset += consumed
+            progress["batches"] += 1
+            progress["replayed_batches"] += result["replayed"]
+            progress["records"] += result["records"]
+            progress["imported"] += result["imported"]
+            if not result["replayed"]:
+                progress["duplicates"] += result["records"] - result["imported"]
+            progress["students_created"] += result["students_created"]
+        failed = False
+    finally:
+        seconds = time.perf_counter() - started
+        progress["seconds"] = round(seconds, 3)
+        progress["records_per_second"] = round(progress["records"] / seconds, 1) if seconds > 0 else None
+        import_stats.record(progress, seconds, failed)
+    return progress
@@ -0,0 +1,228 @@
+import atexit
+import hashlib
+import json
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .recognition import scan_frame
+
+DEFAULT_MAX_JOBS = 1000
+DEFAULT_RETENTION = 300.0
+DEFAULT_THREADS = 4
+CALLBACK_TIMEOUT = 5.0
+# Pause between retries while every recognition worker is busy
+BUSY_RETRY_DELAY = 0.05
+
+STATUSES = ("queued", "running", "done", "failed")
+
+
+class JobsFull(Exception):
+    """Every retained job is still queued or running."""
+
+
+class ScanJobs:
+    """
+    Accepts scan frames without waiting for recognition. Each frame becomes a
+    job that a small thread pool feeds to the recognition workers; clients poll
+    for the result, follow it as server-sent events, or get it POSTed to a
+    callback URL.
+
+    Finished jobs are kept for `retention` seconds and at most `max_jobs` jobs
+    are held at once. Submitting the same frame with the same options while its
+    job is still retained returns that job instead of scanning twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._executor = None
+        self.max_jobs = DEFAULT_MAX_JOBS
+        self.retention = DEFAULT_RETENTION
+        self.threads = DEFAULT_THREADS
+        self.callback_hosts = frozenset()
+        self.stats_counters = {"submitted": 0, "deduplicated": 0, "rejected": 0, "expired": 0,
+                               "done": 0, "failed": 0, "callbacks": 0, "callback_failures": 0}
+
+    def configure(self, max_jobs=None, retention=None, threads=None, callback_hosts=None):
+        with self._lock:
+            if max_jobs is not None:
+                self.max_jobs = max_jobs
+            if retention is not None:
+                self.retention = retention
+            if threads is not None:
+                self.threads = threads
+            if callback_hosts is not None:
+                self.callback_hosts = frozenset(callback_hosts)
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.threads), thread_name_prefix="scan-job")
+        return self._executor
+
+    @staticmethod
+    def job_key(image_bytes, params, cache_scope=None):
+        # The kiosk is part of the key: the same frame sent by two kiosks is two scans, each with its own result
+        digest = hashlib.sha1(image_bytes)
+        digest.update(json.dumps([params, cache_scope], sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def callback_allowed(self, url):
+        # Only hosts the operator listed, so a job cannot be used to reach arbitrary servers
+        parsed = urlparse(url)
+        return parsed.scheme in ("http", "https") and parsed.hostname in self.callback_hosts
+
+    def submit(self, image_bytes, params, config, callback_url=None, cache_scope=None):
+        """Queue a scan and return (job, deduplicated); raises JobsFull when nothing can be evicted."""
+        image_bytes = bytes(image_bytes)
+        key = self.job_key(image_bytes, params, cache_scope)
+        with self._lock:
+            self._expire()
+            job_id = self._by_key.get(key)
+            if job_id is not None:
+                self.stats_counters["deduplicated"] += 1
+                return self._public(self._jobs[job_id]), True
+
+            if len(self._jobs) >= self.max_jobs and not self._evict_finished():
+                self.stats_counters["rejected"] += 1
+                raise JobsFull("Too many scan jobs in progress")
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "key": key,
+                "status": "queued",
+                "created": time.time(),
+                "finished": None,
+                "result": None,
+                "http_status": None,
+                "callback_url": callback_url,
+            }
+            self._jobs[job["id"]] = job
+            self._by_key[key] = job["id"]
+            self.stats_counters["submitted"] += 1
+            self._get_executor().submit(self._run, job, image_bytes, params, config, cache_scope)
+            return self._public(job), False
+
+    def _run(self, job, image_bytes, params, config, cache_scope):
+        self._update(job, status="running")
+        deadline = time.monotonic() + config['RECOGNITION_JOB_TIMEOUT']
+        try:
+            while True:
+                body, http_status = scan_frame(image_bytes, params, config, cache_scope)
+                # A busy pool is a reason to wait here, not to fail: smoothing bursts is the point of jobs
+                if http_status != 503 or time.monotonic() >= deadline:
+                    break
+                time.sleep(BUSY_RETRY_DELAY)
+        except Exception as e:
+            body, http_status = {"success": False, "message": f"Error: {str(e)}"}, 500
+
+        status = "done" if http_status == 200 else "failed"
+        self._update(job, status=status, result=body, http_status=http_status, finished=time.time())
+        if job["callback_url"]:
+            self._send_callback(job)
+
+    def _send_callback(self, job):
+        payload = json.dumps(self._public(job)).encode()
+        request = urllib.request.Request(job["callback_url"], data=payload,
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=CALLBACK_TIMEOUT):
+                pass
+            self._count("callbacks")
+        except Exception:
+            self._count("callback_failures")
+
+    def _update(self, job, **fields):
+        with self._changed:
+            job.update(fields)
+            if fields.get("status") in ("done", "failed"):
+                self.stats_counters[fields["status"]] += 1
+            if fields.get("status") == "failed" and self._by_key.get(job["key"]) == job["id"]:
+                # A retry of a failed frame should scan again, not get the failure back
+                del self._by_key[job["key"]]
+            self._changed.notify_all()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def _expire(self):
+        # Jobs are in submission order, so everything past the first recent one is recent too
+        cutoff = time.time() - self.retention
+        for job in list(self._jobs.values()):
+            if job["created"] > cutoff:
+                break
+            if job["finished"] is not None and job["finished"] <= cutoff:
+                self._drop(job)
+                self.stats_counters["expired"] += 1
+
+    def _evict_finished(self):
+        for job in self._jobs.values():
+            if job["finished"] is not None:
+                self._drop(job)
+                self.stats_counters["expired"] += 1
+                return True
+        return False
+
+    def _drop(self, job):
+        del self._jobs[job["id"]]
+        if self._by_key.get(job["key"]) == job["id"]:
+            del self._by_key[job["key"]]
+
+    @staticmethod
+    def _public(job):
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "created": job["created"],
+            "finished": job["finished"],
+            "result": job["result"],
+            "http_status": job["http_status"],
+        }
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job is not None else None
+
+    def wait(self, job_id, last_status=None, timeout=None):
+        """Block until the job's status differs from last_status (or timeout) and return it."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]["status"] != last_status, timeout)
+            job = self._jobs.get(job_id)
+            return self._public(job) if job is not None else None
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            result = dict(self.stats_counters)
+            by_status = dict.fromkeys(STATUSES, 0)
+            for job in self._jobs.values():
+                by_status[job["status"]] += 1
+            result.update({
+                "retained": len(self._jobs),
+                "max_jobs": self.max_jobs,
+                "retention": self.retention,
+                "by_status": by_status,
+            })
+        return result
+
+
+scan_jobs = ScanJobs()
+atexit.register(scan_jobs.shutdown)
@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+import numpy as np
+
+# dlib face encodings are 128-d float64 vectors
+ENCODING_SIZE = 128
+
+# Same default threshold face_recognition.compare_faces uses
+DEFAULT_TOLERANCE = 0.6
+
+# index is a row in the gallery, margin is how much further away the runner-up is
+Match = namedtuple("Match", ["index", "distance", "margin", "matched"])
+
+
+def face_distances(probes, encodings):
+    """
+    Euclidean distance from every probe encoding to every gallery encoding.
+
+    Returns an (M, N) matrix computed with a single matrix product, using
+    |a - b|^2 = |a|^2 + |b|^2 - 2ab instead of a per-student loop.
+    """
+    probes = np.asarray(probes, dtype=np.float64).reshape(-1, ENCODING_SIZE)
+    if len(encodings) == 0:
+        return np.empty((len(probes), 0))
+
+    squared = np.einsum("ij,ij->i", probes, probes)[:, None] \
+        + np.einsum("ij,ij->i", encodings, encodings)[None, :] \
+        - 2.0 * (probes @ encodings.T)
+    # Rounding can push identical vectors slightly below zero
+    np.maximum(squared, 0.0, out=squared)
+    return np.sqrt(squared, out=squared)
+
+
+def nearest(distances, k=2):
+    """Columns and distances of the k smallest entries of each row, closest first."""
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return np.empty((len(distances), 0), dtype=np.int64), np.empty((len(distances), 0))
+
+    columns = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(distances, columns, axis=1)
+    order = values.argsort(axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def matches_from_neighbours(rows, distances, tolerance=DEFAULT_TOLERANCE):
+    """Turn top-k search results (row -1 meaning no candidate) into one Match per probe."""
+    matches = []
+    for probe_rows, probe_distances in zip(rows, distances):
+        if len(probe_rows) == 0 or probe_rows[0] < 0:
+            matches.append(Match(None, None, None, False))
+            continue
+        distance = float(probe_distances[0])
+        margin = float(probe_distances[1]) - distance if len(probe_rows) > 1 and probe_rows[1] >= 0 else float("inf")
+        matches.append(Match(int(probe_rows[0]), distance, margin, distance <= tolerance))
+    return matches
+
+
+def best_matches(probes, encodings, tolerance=DEFAULT_TOLERANCE):
+    """Return one Match per probe: the closest gallery row, if it is within tolerance."""
+    rows, distances = nearest(face_distances(probes, encodings), k=2)
+    return matches_from_neighbours(rows, distances, tolerance)
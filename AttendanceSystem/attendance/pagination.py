@@ -0,0 +1,96 @@
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_PAGE_SIZE = 500
+
+# Page sizes, set from the app config by configure()
+settings = {
+    "page_size": DEFAULT_PAGE_SIZE,
+    "max_page_size": DEFAULT_MAX_PAGE_SIZE,
+}
+
+
+class CursorError(ValueError):
+    """A page cursor that was not issued by keyset_page()."""
+
+
+def configure(**options):
+    settings.update(options)
+
+
+def page_size(requested=None):
+    """The requested page size, or the default, capped at max_page_size."""
+    try:
+        size = int(requested) if requested else settings["page_size"]
+    except (TypeError, ValueError):
+        size = settings["page_size"]
+    return max(1, min(size, settings["max_page_size"]))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, length):
+    """The sort key a cursor points after; raises CursorError if it is malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorError("Invalid page cursor")
+    if not isinstance(key, list) or len(key) != length:
+        raise CursorError("Invalid page cursor")
+    return key
+
+
+def keyset_query(select, conditions, keys, after=False, descending=False):
+    """
+    The SQL keyset_page() runs: select filtered by conditions and, with
+    after, by the row-value seek past a cursor's key, in keys order, with a
+    LIMIT placeholder last. The seek takes the key's first value, then the
+    whole key.
+    """
+    conditions = list(conditions)
+    expressions = [expression for expression, _ in keys]
+    if after:
+        operator = "<" if descending else ">"
+        # SQLite only seeks an expression index on a plain comparison, not on the row value, so the first key's
+        # bound is spelled out as well
+        conditions.append(f"{expressions[0]} {operator}= ?")
+        conditions.append(f"({', '.join(expressions)}) {operator} ({', '.join('?' * len(keys))})")
+
+    direction = "DESC" if descending else "ASC"
+    query = select
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(f"{expression} {direction}" for expression in expressions)
+    return query + " LIMIT ?"
+
+
+def keyset_page(conn, select, conditions, params, keys, cursor=None, limit=None, descending=False):
+    """
+    One page of select's rows in (keys) order, starting after cursor.
+
+    keys are (SQL expression, position in the selected row) pairs that
+    together order the rows uniquely, e.g. (a.ts, a.id). Instead of an OFFSET
+    the page seeks straight to the rows after the last key of the previous
+    page, so with an index on the keys page 1000 costs the same as page 1.
+    conditions are SQL filters ANDed together, with their params.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = page_size(limit)
+    params = list(params)
+    if cursor:
+        key = decode_cursor(cursor, len(keys))
+        params.extend([key[0]] + key)
+    query = keyset_query(select, conditions, keys, after=bool(cursor), descending=descending)
+    # One row past the page tells us whether there is a next page without a COUNT
+    rows = conn.execute(query, params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][position] for _, position in keys)
+    return rows, next_cursor
@@ -0,0 +1,71 @@
+import datetime
+import threading
+
+from .db import get_data_version
+
+MARKED_ON_DAY = "SELECT student_id FROM attendance WHERE day = ?"
+
+
+class PresenceSet:
+    """
+    Per-worker set of the student ids already marked today.
+
+    Like the gallery it is stamped with the attendance table's version
+    counter, so rows added or removed elsewhere (gov imports, deleted
+    students, other workers) are noticed with one primary-key lookup instead
+    of scanning attendance. It starts empty again when the date changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.day = None
+        self.version = None
+        self.ids = frozenset()
+        self.hits = 0
+        self.reloads = 0
+        self.patches = 0
+
+    def marked_today(self, conn, today=None):
+        """Return (day, version, ids marked that day), reloading only when stale."""
+        today = today or datetime.date.today().strftime("%Y-%m-%d")
+        version = get_data_version(conn, "attendance")
+        with self._lock:
+            if self.day == today and self.version == version:
+                self.hits += 1
+                return today, version, self.ids
+            rows = conn.execute(MARKED_ON_DAY, (today,)).fetchall()
+            self.day, self.version, self.ids = today, version, frozenset(row[0] for row in rows)
+            self.reloads += 1
+            return today, version, self.ids
+
+    def add(self, conn, day, version, student_ids):
+        """
+        Record ids this worker just inserted for day, on top of the state read
+        at version. Any other change in between drops the set instead.
+        """
+        current = get_data_version(conn, "attendance")
+        with self._lock:
+            if self.day == day and self.version == version and current == version + len(student_ids):
+                self.ids = self.ids | frozenset(student_ids)
+                self.version = current
+                self.patches += 1
+            else:
+                self.version = None
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "day": self.day,
+                "marked": len(self.ids),
+                "version": self.version,
+                "hits": self.hits,
+                "reloads": self.reloads,
+                "patches": self.patches,
+            }
+
+
+presence = PresenceSet()
@@ -0,0 +1,54 @@
+from .changelog import CHANGES_AFTER, CURRENT_VERSION
+from .columnar import EXPORT_QUERY
+from .dashboard import TODAY_COUNT
+from .imports import RESOLVE_ROLLS
+from .pagination import keyset_query
+from .presence import MARKED_ON_DAY
+from .rollups import SUMMARY_QUERIES
+from .routes_admin import EXPORT_ALL, EXPORT_DAY
+from .routes_attendance import LOGS_KEYS, LOGS_SELECT, STUDENT_HISTORY, STUDENTS_KEYS, STUDENTS_SELECT
+from .routes_gov import EXPORT_RANGE, REPORTS_KEYS, REPORTS_SELECT
+
+DAY = ("2000-01-01",)
+DAY_RANGE = ("2000-01-01", "2000-01-31")
+PAGE = 101
+
+# Hot read paths, as the app runs them, and the index each must use; check_query_plans() flags any that scan
+# instead. Pages are checked past a cursor, the form every page but the first takes.
+QUERY_PLAN_CHECKS = {
+    "today_count": (TODAY_COUNT, DAY, "idx_attendance_day_student"),
+    "presence_day": (MARKED_ON_DAY, DAY, "idx_attendance_day_student"),
+    "student_history": (STUDENT_HISTORY, (1,), "idx_attendance_student_day"),
+    "export_day": (EXPORT_DAY, DAY, "idx_attendance_day_student"),
+    "export_all": (EXPORT_ALL, (), "idx_attendance_ts"),
+    "export_range": (EXPORT_RANGE, DAY_RANGE, "idx_attendance_day_student"),
+    "export_columnar": (EXPORT_QUERY, DAY_RANGE, "idx_attendance_day_student"),
+    "logs_page": (keyset_query(LOGS_SELECT, [], LOGS_KEYS, after=True, descending=True),
+                  (0, 0, 0, PAGE), "idx_attendance_ts_sort"),
+    "logs_page_day": (keyset_query(LOGS_SELECT, ["a.day = ?"], LOGS_KEYS, after=True, descending=True),
+                      DAY + (0, 0, 0, PAGE), "idx_attendance_day_student"),
+    "students_page": (keyset_query(STUDENTS_SELECT, [], STUDENTS_KEYS, after=True),
+                      ("", "", 0, PAGE), "idx_students_name_sort"),
+    "reports_page": (keyset_query(REPORTS_SELECT, ["a.day = ?"], REPORTS_KEYS, after=True, descending=True),
+                     DAY + (0, 0, 0, PAGE), "idx_attendance_day_student"),
+    "import_rolls": (RESOLVE_ROLLS, ('["1"]',), "idx_students_roll"),
+    "pending_changes": (CURRENT_VERSION, ("attendance",), "PRIMARY KEY"),
+    "changes_since": (CHANGES_AFTER, ("attendance", 0), "PRIMARY KEY"),
+}
+QUERY_PLAN_CHECKS.update({
+    f"rollup_summary_{number}": (query, DAY_RANGE, "PRIMARY KEY") for number, query in enumerate(SUMMARY_QUERIES)
+})
+
+
+def check_query_plans(conn):
+    """
+    Run EXPLAIN QUERY PLAN on every QUERY_PLAN_CHECKS query.
+
+    Returns {name: (ok, plan lines)}; ok is False when the expected index is
+    not used, e.g. after a query was rewritten into a non-sargable form.
+    """
+    results = {}
+    for name, (query, params, index) in QUERY_PLAN_CHECKS.items():
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        results[name] = (any(index in line for line in plan), plan)
+    return results
@@ -0,0 +1,241 @@
+import datetime
+import time
+
+from .db import get_db_conn
+from .detection import record_detection
+from .frame_cache import frame_cache, frame_hash
+from .frames import FrameError
+from .gallery import gallery, resolve_scope
+from .matching import matches_from_neighbours
+from .presence import presence
+from .tracking import stream_sessions
+from .workers import recognition_pool, encode_frame, recognize_frame, recognize_stream_frame, PoolBroken, \
+    PoolBusy, RecognitionTimeout
+from .write_behind import attendance_writer, insert_marks
+
+
+def identify(conn, face_encodings, scope=None, tolerance=0.6, fallback_to_full=False):
+    """
+    Match every encoding against the gallery (or the scope's sub-gallery) in one batch.
+
+    Returns the snapshot the matches refer to together with one Match per encoding.
+    """
+    snapshot = gallery.get_scoped(conn, scope)
+    rows, distances = snapshot.index.search(face_encodings)
+    matches = matches_from_neighbours(rows, distances, tolerance)
+
+    if scope and fallback_to_full and not any(match.matched for match in matches):
+        snapshot = gallery.get(conn)
+        rows, distances = snapshot.index.search(face_encodings)
+        matches = matches_from_neighbours(rows, distances, tolerance)
+    return snapshot, matches
+
+
+def mark_attendance(conn, student_ids):
+    """
+    Mark today's attendance for every student not yet marked, in one transaction.
+
+    Students already present are answered from the per-worker presence set,
+    so a repeat scan does not query attendance at all. With write-behind on,
+    the rows are handed to the attendance writer, which commits them batched
+    with other scans'. Returns the set of ids that got a new row; the others
+    were already marked.
+    """
+    student_ids = list(dict.fromkeys(student_ids))
+    if not student_ids:
+        return set()
+
+    now = datetime.datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    day, version, already_marked = presence.marked_today(conn, today)
+    new_ids = [student_id for student_id in student_ids if student_id not in already_marked]
+    if not new_ids:
+        return set()
+
+    if attendance_writer.enabled:
+        return attendance_writer.submit(new_ids, timestamp, today, int(now.timestamp()))
+
+    inserted = insert_marks(conn, new_ids, timestamp, today, int(now.timestamp()))
+    conn.commit()
+    presence.add(conn, day, version, inserted)
+    return set(inserted)
+
+
+def face_results(snapshot, matches, face_locations, newly_marked):
+    """Per-face outcome of a group scan: marked, already_marked or unknown, with its box."""
+    results = []
+    seen = set()
+    for match, (top, right, bottom, left) in zip(matches, face_locations):
+        result = {"status": "unknown", "box": {"top": top, "right": right, "bottom": bottom, "left": left}}
+        if match.matched:
+            student_id = int(snapshot.ids[match.index])
+            # The same student found twice in one photo is only marked once
+            marked = student_id in newly_marked and student_id not in seen
+            seen.add(student_id)
+            result.update({
+                "status": "marked" if marked else "already_marked",
+                "student_id": student_id,
+                "name": snapshot.names[match.index],
+                "roll": snapshot.rolls[match.index],
+                "distance": round(match.distance, 4),
+            })
+        results.append(result)
+    return results
+
+
+def _detect(job, *args, record=True):
+    """Run a detection job in the recognition pool: (detection, None), or (None, (body, status)) on failure."""
+    try:
+        detection = recognition_pool.run(job, *args)
+    except FrameError as e:
+        return None, ({"success": False, "message": str(e)}, 200)
+    except (PoolBusy, PoolBroken):
+        return None, ({"success": False, "message": "Recognition is busy, please try again"}, 503)
+    except RecognitionTimeout:
+        return None, ({"success": False, "message": "Recognition timed out, please try again"}, 504)
+    if record:
+        record_detection(detection)
+    return detection, None
+
+
+def scan_frame(image_bytes, params, config, cache_scope=None):
+    """
+    The whole scan pipeline for one uploaded frame: detect, match and mark.
+
+    Shared by the blocking scan route and the scan job workers, so it takes the
+    request's params and the app config explicitly. With a cache_scope (the
+    kiosk's id), a near-identical frame recently scanned by the same kiosk with
+    the same options reuses that frame's face boxes and only encodes. Returns the JSON body
+    and the HTTP status.
+    """
+    # Optional class/section or named room limits matching to that roster
+    try:
+        scope = resolve_scope(params.get('class'), params.get('section'), params.get('room'),
+                              config['KIOSK_ROOMS'])
+    except ValueError as e:
+        return {"success": False, "message": str(e)}, 200
+
+    # Detect on a downscaled copy and encode at full resolution, using the requested profile
+    group_mode = params.get('mode') == 'group'
+    profile = params.get('profile') or config['GROUP_DETECTION_PROFILE' if group_mode else 'DETECTION_PROFILE']
+    # Single scans can be gated by a cheap Haar check; group photos have faces too small for it
+    prefilter = config['FACE_PREFILTER'] and not group_mode
+
+    # Resubmitted frames skip detection: only the face boxes are reused, the faces are still encoded
+    frame_key = None
+    locations = None
+    if cache_scope is not None and frame_cache.enabled:
+        frame_key = frame_hash(image_bytes)
+        partition = (cache_scope, profile, prefilter, scope)
+        locations = frame_cache.get(partition, frame_key) if frame_key is not None else None
+
+    if locations is not None:
+        # Encoding only; kept out of the detection timings, which the prefilter savings are estimated from
+        detection, error = _detect(encode_frame, bytes(image_bytes), profile, locations, record=False)
+        if error:
+            return error
+    else:
+        # Decode, detect and encode in a recognition worker process
+        detection, error = _detect(recognize_frame, bytes(image_bytes), profile, prefilter)
+        if error:
+            return error
+        if frame_key is not None:
+            frame_cache.put(partition, frame_key, detection.locations)
+    face_locations, face_encodings = detection.locations, detection.encodings
+
+    if not face_encodings:
+        return {"success": False, "message": "No face detected in the image",
+                "profile": detection.profile, "prefiltered": detection.prefiltered}, 200
+
+    conn = get_db_conn()
+    try:
+        # Match every detected face against the cached gallery index in one batch
+        snapshot, matches = identify(conn, face_encodings, scope,
+                                     config['FACE_MATCH_TOLERANCE'], config['SCOPE_FALLBACK_TO_FULL'])
+
+        # Group mode marks every recognized face in the photo at once
+        if group_mode:
+            matched_ids = [int(snapshot.ids[m.index]) for m in matches if m.matched]
+            newly_marked = mark_attendance(conn, matched_ids)
+            faces = face_results(snapshot, matches, face_locations, newly_marked)
+            counts = {status: sum(1 for face in faces if face["status"] == status)
+                      for status in ("marked", "already_marked", "unknown")}
+            return {
+                "success": True,
+                "message": f"Marked {counts['marked']}, already marked {counts['already_marked']}, "
+                           f"unknown {counts['unknown']}",
+                "counts": counts,
+                "faces": faces,
+                "profile": detection.profile,
+            }, 200
+
+        for match in matches:
+            if match.matched:
+                student_id = int(snapshot.ids[match.index])
+                # Student details come from the same gallery snapshot that matched
+                name, roll = snapshot.names[match.index], snapshot.rolls[match.index]
+
+                # Mark attendance unless already marked today
+                if not mark_attendance(conn, [student_id]):
+                    return {"success": True, "message": f"Attendance already marked for {name} (Roll: {roll})",
+                            "profile": detection.profile}, 200
+
+                return {"success": True, "message": f"Attendance marked for {name} (Roll: {roll})",
+                        "profile": detection.profile}, 200
+
+        return {"success": False, "message": "Face not recognized", "profile": detection.profile}, 200
+    finally:
+        conn.close()
+
+
+def stream_frame(session, image_bytes, params, config):
+    """
+    One frame of a streaming scan. Faces are followed from frame to frame as
+    tracks; only faces without an identity yet are encoded and matched, so a
+    student standing in front of the kiosk is recognized once, not per frame.
+    """
+    try:
+        scope = resolve_scope(params.get('class'), params.get('section'), params.get('room'),
+                              config['KIOSK_ROOMS'])
+    except ValueError as e:
+        return {"success": False, "message": str(e)}, 200
+    profile = params.get('profile') or config['DETECTION_PROFILE']
+
+    # Frames of one kiosk are handled in order, so tracks see every frame
+    with session.lock:
+        now = time.monotonic()
+        detection, error = _detect(recognize_stream_frame, bytes(image_bytes), profile,
+                                   session.settled_boxes(now), config['STREAM_IOU_THRESHOLD'])
+        if error:
+            return error
+
+        sightings = session.update(detection.locations, stream_sessions.track_ttl, config['STREAM_IOU_THRESHOLD'])
+        pending = [(track, encoding) for (track, _), encoding in zip(sightings, detection.encodings)
+                   if encoding is not None and track.needs_identity(now)]
+
+        marked = []
+        if pending:
+            conn = get_db_conn()
+            try:
+                snapshot, matches = identify(conn, [encoding for _, encoding in pending], scope,
+                                             config['FACE_MATCH_TOLERANCE'], config['SCOPE_FALLBACK_TO_FULL'])
+                newly_marked = mark_attendance(conn, [int(snapshot.ids[m.index]) for m in matches if m.matched])
+            finally:
+                conn.close()
+            locations = [track.box for track, _ in pending]
+            for (track, _), face in zip(pending, face_results(snapshot, matches, locations, newly_marked)):
+                track.identify(face["status"], now, face.get("student_id"), face.get("name"), face.get("roll"))
+                if face["status"] == "marked":
+                    marked.append(f"{face['name']} (Roll: {face['roll']})")
+
+        stream_sessions.count(frames=1, faces=len(sightings), tracks=sum(new for _, new in sightings),
+                              encoded=sum(encoding is not None for encoding in detection.encodings),
+                              identified=len(pending))
+        return {
+            "success": True,
+            "message": f"Attendance marked for {', '.join(marked)}" if marked else None,
+            "tracks": [track.to_dict(new) for track, new in sightings],
+            "profile": detection.profile,
+        }, 200
@@ -0,0 +1,109 @@
+# Attendance counts per day x class x section x hour, kept current by triggers so the analytics pages
+# read a few pre-grouped rows per day instead of grouping the whole attendance table on every view
+ROLLUP_TABLE = '''CREATE TABLE IF NOT EXISTS attendance_rollup (
+                    day TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    section TEXT NOT NULL,
+                    hour TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (day, class, section, hour)
+                ) WITHOUT ROWID'''
+
+# NULLs would never conflict in the primary key, so they are stored as '' and read back as NULL
+_GROUP = "IFNULL(s.day, ''), IFNULL(s.class, ''), IFNULL(s.section, ''), " \
+         "IFNULL(strftime('%H', s.ts, 'unixepoch', 'localtime'), '')"
+
+# The WHERE true keeps SQLite from reading ON CONFLICT as a join constraint
+_ADJUST = '''INSERT INTO attendance_rollup (day, class, section, hour, count)
+                SELECT {group}, {sign}COUNT(*) FROM {source} WHERE true GROUP BY 1, 2, 3, 4
+                ON CONFLICT (day, class, section, hour) DO UPDATE SET count = count + excluded.count;'''
+
+
+def _adjust(sign, source):
+    return _ADJUST.format(group=_GROUP, sign=sign, source=source)
+
+
+def _attendance_row(row):
+    # One attendance row (NEW or OLD) with its student's current class and section
+    return f"(SELECT {row}.day AS day, {row}.ts AS ts, class, section FROM students WHERE id = {row}.student_id) AS s"
+
+
+def _student_rows(row):
+    # Every attendance row of one student (NEW or OLD), with that version of the student's class and section
+    return f"(SELECT a.day, a.ts, {row}.class AS class, {row}.section AS section " \
+           f"FROM attendance a WHERE a.student_id = {row}.id) AS s"
+
+
+ROLLUP_TRIGGERS = {
+    "attendance_rollup_insert": ("AFTER INSERT ON attendance",
+                                 [_adjust("", _attendance_row("NEW"))]),
+    "attendance_rollup_delete": ("AFTER DELETE ON attendance",
+                                 [_adjust("-", _attendance_row("OLD"))]),
+    "attendance_rollup_update": ("AFTER UPDATE OF student_id, day, ts ON attendance",
+                                 [_adjust("-", _attendance_row("OLD")),
+                                  _adjust("", _attendance_row("NEW"))]),
+    "students_rollup_insert": ("AFTER INSERT ON students",
+                               [_adjust("", _student_rows("NEW"))]),
+    "students_rollup_delete": ("AFTER DELETE ON students",
+                               [_adjust("-", _student_rows("OLD"))]),
+    "students_rollup_update": ("AFTER UPDATE OF id, class, section ON students",
+                               [_adjust("-", _student_rows("OLD")),
+                                _adjust("", _student_rows("NEW"))]),
+}
+
+
+def ensure_rollups(cursor):
+    """
+    Create the rollup table and its triggers. A table created just now is
+    filled from the existing attendance rows.
+
+    The triggers adjust the counts in the same transaction as any change that
+    moves an attendance row between groups: rows inserted, deleted or
+    re-pointed, and students inserted, deleted or moved to another class or
+    section. That holds for every writer, scans and gov imports alike.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_rollup'")
+    created = cursor.fetchone() is None
+    cursor.execute(ROLLUP_TABLE)
+    for name, (event, statements) in ROLLUP_TRIGGERS.items():
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS {name} {event}
+                            BEGIN
+                                {" ".join(statements)}
+                            END''')
+    if created:
+        rebuild_rollups(cursor)
+
+
+def rebuild_rollups(cursor):
+    """Recompute every rollup count from attendance; returns the number of groups written."""
+    cursor.execute("DELETE FROM attendance_rollup")
+    cursor.execute(f'''INSERT INTO attendance_rollup (day, class, section, hour, count)
+                        SELECT {_GROUP}, COUNT(*)
+                        FROM (SELECT a.day, a.ts, st.class, st.section
+                              FROM attendance a JOIN students st ON a.student_id = st.id) AS s
+                        GROUP BY 1, 2, 3, 4''')
+    return cursor.rowcount
+
+
+# The analytics series read by attendance_summary(), in the order it returns them
+SUMMARY_QUERIES = (
+    '''SELECT day AS date, SUM(count) AS count FROM attendance_rollup
+       WHERE day BETWEEN ? AND ? GROUP BY day HAVING SUM(count) > 0 ORDER BY day''',
+    '''SELECT NULLIF(class, '') AS class, SUM(count) AS count FROM attendance_rollup
+       WHERE day BETWEEN ? AND ? GROUP BY 1 HAVING SUM(count) > 0 ORDER BY count DESC''',
+    '''SELECT NULLIF(section, '') AS section, SUM(count) AS count FROM attendance_rollup
+       WHERE day BETWEEN ? AND ? GROUP BY 1 HAVING SUM(count) > 0 ORDER BY count DESC''',
+    '''SELECT NULLIF(hour, '') AS hour, SUM(count) AS count FROM attendance_rollup
+       WHERE day BETWEEN ? AND ? GROUP BY 1 HAVING SUM(count) > 0 ORDER BY hour''',
+)
+
+
+def attendance_summary(cursor, start_date, end_date):
+    """
+    The four analytics series for a date range, read from the rollup:
+    (daily counts, by class, by section, by hour), each a list of (label, count).
+    Groups whose rows were all deleted linger at zero until a rebuild and are skipped.
+    """
+    by_day, by_class, by_section, by_hour = (cursor.execute(query, (start_date, end_date)).fetchall()
+                                             for query in SUMMARY_QUERIES)
+    return by_day, by_class, by_section, by_hour
@@ -1,17 +1,32 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-import sqlite3
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
 from werkzeug.security import check_password_hash, generate_password_hash
 import os
 import json
 import datetime
-from .db import DB_PATH
+from .db import get_db_conn
+from .dashboard import dashboard_stats
+from .rollups import attendance_summary
+from .exports import stream_csv, wants_gzip
+from .gallery import gallery
+from .workers import recognition_pool, encode_image
 
 # --- Blueprint setup ---
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-
-def get_db_conn():
-    return sqlite3.connect(DB_PATH)
+# CSV export of one day, and of all records
+EXPORT_DAY = """
+    SELECT s.roll, s.name, a.timestamp 
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.id 
+    WHERE a.day = ? 
+    ORDER BY a.ts
+"""
+EXPORT_ALL = """
+    SELECT s.roll, s.name, a.timestamp 
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.id 
+    ORDER BY a.ts
+"""
 
 
 # ---------- Routes ----------
@@ -48,31 +63,19 @@ def dashboard():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
     
-    # Get statistics for dashboard
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # Get student count
-    c.execute("SELECT COUNT(*) FROM students")
-    student_count = c.fetchone()[0]
-    
-    # Get today's attendance count
-    import datetime
-    today = datetime.date.today().strftime('%Y-%m-%d')
-    c.execute("SELECT COUNT(*) FROM attendance WHERE date(timestamp) = ?", (today,))
-    today_attendance = c.fetchone()[0]
-    
-    # Get total records
-    c.execute("SELECT COUNT(*) FROM attendance")
-    total_records = c.fetchone()[0]
+    # Dashboard counters come from the per-worker cache, refreshed only after the data changed
+    conn = get_db_conn(readonly=True)
+    stats = dashboard_stats.get(conn)
+    conn.close()
+    student_count = stats['student_count']
+    today_attendance = stats['today_attendance']
+    total_records = stats['total_records']
     
     # Calculate attendance rate (if students exist)
     attendance_rate = '0%'
     if student_count > 0:
         attendance_rate = f"{int((today_attendance / student_count) * 100)}%"
     
-    conn.close()
-    
     return render_template('dashboard.html', 
                            student_count=student_count,
                            today_attendance=today_attendance,
@@ -209,8 +212,6 @@ def admin_register():
             return render_template('register.html')
         
         if file and file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            import face_recognition
-            import numpy as np
             from PIL import Image
             import io
             
@@ -218,15 +219,13 @@ def admin_register():
                 # Read and process the uploaded image
                 image_data = file.read()
                 image = Image.open(io.BytesIO(image_data))
-                image_array = np.array(image)
                 
-                # Generate face encoding
-                face_locations = face_recognition.face_locations(image_array)
+                # Detect and encode in a recognition worker process
+                face_locations, face_encodings = recognition_pool.run(encode_image, image_data)
                 if not face_locations:
                     flash('No face detected in the image. Please upload a clear photo with a visible face.', 'error')
                     return render_template('register.html')
                 
-                face_encodings = face_recognition.face_encodings(image_array, face_locations)
                 if not face_encodings:
                     flash('Could not generate face encoding. Please try with a different image.', 'error')
                     return render_template('register.html')
@@ -257,6 +256,7 @@ def admin_register():
                 image.save(save_path, 'JPEG')
                 
                 conn.commit()
+                gallery.upsert(conn, next_id)
                 conn.close()
                 
                 flash(f'Student {name} (Roll: {roll}) registered successfully with ID: {next_id}', 'success')
@@ -285,50 +285,12 @@ def analytics():
     start_date = request.args.get('start_date', (today.replace(day=1)).strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
     
-    conn = get_db_conn()
+    # Reports only read, through a read-only connection that never holds up attendance writes
+    conn = get_db_conn(readonly=True)
     c = conn.cursor()
     
-    # Get daily attendance counts
-    c.execute("""
-        SELECT date(timestamp) as date, COUNT(*) as count 
-        FROM attendance 
-        WHERE date(timestamp) BETWEEN ? AND ? 
-        GROUP BY date(timestamp) 
-        ORDER BY date(timestamp)
-    """, (start_date, end_date))
-    daily_counts = c.fetchall()
-    
-    # Get attendance by class
-    c.execute("""
-        SELECT s.class, COUNT(a.id) as count 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) BETWEEN ? AND ? 
-        GROUP BY s.class 
-        ORDER BY count DESC
-    """, (start_date, end_date))
-    class_attendance = c.fetchall()
-    
-    # Get attendance by section
-    c.execute("""
-        SELECT s.section, COUNT(a.id) as count 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) BETWEEN ? AND ? 
-        GROUP BY s.section 
-        ORDER BY count DESC
-    """, (start_date, end_date))
-    section_attendance = c.fetchall()
-    
-    # Get attendance trend by hour
-    c.execute("""
-        SELECT strftime('%H', timestamp) as hour, COUNT(*) as count 
-        FROM attendance 
-        WHERE date(timestamp) BETWEEN ? AND ? 
-        GROUP BY hour 
-        ORDER BY hour
-    """, (start_date, end_date))
-    hourly_trend = c.fetchall()
+    # Daily, class, section and hourly counts, read from the pre-grouped rollup rows of the range
+    daily_counts, class_attendance, section_attendance, hourly_trend = attendance_summary(c, start_date, end_date)
     
     # Convert data for charts
     dates = [row[0] for row in daily_counts]
@@ -410,6 +372,9 @@ def reassign_student_ids():
         conn.commit()
         conn.close()
         
+        # Every id changed, so the cached gallery has to be rebuilt
+        gallery.invalidate()
+        
         flash(f'Successfully reassigned IDs for {len(students)} students. IDs now run from 1 to {len(students)}.', 'success')
         
     except Exception as e:
@@ -425,48 +390,15 @@ def export_csv():
     # Get the date parameter
     date = request.args.get('date')
     
-    # Connect to database
-    conn = get_db_conn()
-    c = conn.cursor()
+    # Stream straight from a read-only connection, one batch of rows at a time
+    conn = get_db_conn(readonly=True)
     
-    # Query for attendance records for the specified date
+    # Query for attendance records for the specified date; if no date specified, get all records
     if date:
-        c.execute("""
-            SELECT s.roll, s.name, a.timestamp 
-            FROM attendance a 
-            JOIN students s ON a.student_id = s.id 
-            WHERE date(a.timestamp) = ? 
-            ORDER BY a.timestamp
-        """, (date,))
+        query, params = EXPORT_DAY, (date,)
     else:
-        # If no date specified, get all records
-        c.execute("""
-            SELECT s.roll, s.name, a.timestamp 
-            FROM attendance a 
-            JOIN students s ON a.student_id = s.id 
-            ORDER BY a.timestamp
-        """)
-    
-    records = c.fetchall()
-    conn.close()
-    
-    # Create CSV response
-    from flask import Response
-    import csv
-    import io
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Roll Number', 'Name', 'Timestamp'])
-    
-    # Write data
-    for record in records:
-        writer.writerow(record)
-    
-    # Create response
-    response = Response(output.getvalue(), mimetype='text/csv')
-    response.headers["Content-Disposition"] = f"attachment; filename=attendance_{date or 'all'}.csv"
+        query, params = EXPORT_ALL, ()
     
-    return response
+    return stream_csv(conn, query, params, ['Roll Number', 'Name', 'Timestamp'],
+                      f"attendance_{date or 'all'}.csv",
+                      gzip=wants_gzip(), batch_size=current_app.config['EXPORT_BATCH_SIZE'])
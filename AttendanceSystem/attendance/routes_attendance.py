@@ -1,14 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash
-import sqlite3
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash, current_app, \
+    Response, stream_with_context
+import json
+import uuid
 import datetime
-import face_recognition
-import cv2
 import os
 from PIL import Image
-import numpy as np
 from io import BytesIO
 import base64
-import re
 from werkzeug.utils import secure_filename
 
 def allowed_file(filename):
@@ -17,13 +15,56 @@ def allowed_file(filename):
 
 attendance_bp = Blueprint("attendance", __name__, url_prefix="/attendance")
 
-from .db import DB_PATH
+from .db import get_db_conn
+from .gallery import gallery
+from .recognition import scan_frame, stream_frame
+from .tracking import stream_sessions
+from .frame_cache import frame_cache
+from .presence import presence
+from .write_behind import attendance_writer
+from .dashboard import dashboard_stats
+from .exports import export_stats
+from .imports import import_stats
+from .jobs import scan_jobs, JobsFull
+from .admission import scan_admission, Overloaded
+from .frames import FrameError, read_frame_bytes, request_params
+from .detection import stats as detection_stats
+from .workers import recognition_pool, encode_image
+from . import face_index
+from .pagination import CursorError, keyset_page, page_size
 # Update to use absolute path
 KNOWN_FACES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "known_faces"))
 
+# Attendance logs, paged newest first by (ts, id); the (ts) index walks all of history in order,
+# so a deep page seeks instead of skipping rows. Rows whose timestamp could not be read sort last, as ts 0.
+LOGS_SELECT = """
+    SELECT a.id, s.name, s.roll, a.timestamp, a.ts, IFNULL(a.ts, 0) 
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.id 
+"""
+LOGS_KEYS = [("IFNULL(a.ts, 0)", 5), ("a.id", 0)]
 
-def get_db_conn():
-    return sqlite3.connect(DB_PATH)
+# Students, paged in name order; the id breaks ties between students with the same name
+# Students without a name sort first, as ''; a NULL in the key would drop them out of every page
+STUDENTS_SELECT = "SELECT id, name, roll, class, section, IFNULL(name, '') FROM students"
+STUDENTS_KEYS = [("IFNULL(name, '')", 5), ("id", 0)]
+
+# One student's attendance, latest first
+STUDENT_HISTORY = """
+    SELECT a.timestamp 
+    FROM attendance a 
+    WHERE a.student_id = ? 
+    ORDER BY a.ts DESC
+"""
+
+
+
+
+def kiosk_id():
+    # Identifies this browser so per-kiosk caches never share entries between kiosks
+    if "kiosk_id" not in session:
+        session["kiosk_id"] = uuid.uuid4().hex
+    return session["kiosk_id"]
 
 
 # ---------- ROUTES ----------
@@ -46,89 +87,156 @@ def scan_attendance():
     # For POST requests (from the new UI)
     if request.method == "POST":
         try:
-            # Get the image data from JSON
-            data = request.get_json()
-            if not data or 'image' not in data:
-                return jsonify({"success": False, "message": "No image data provided"})
-            
-            # Process the base64 image
-            import base64
-            import numpy as np
-            import re
-            
-            # Extract the base64 encoded image data
-            image_data = data['image']
-            image_data = re.sub('^data:image/.+;base64,', '', image_data)
-            image_bytes = base64.b64decode(image_data)
-            
-            # Convert to numpy array for face_recognition
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Process the image for face recognition
-            conn = get_db_conn()
-            c = conn.cursor()
-            
-            # Load known faces
-            known_encodings = []
-            known_ids = []
-            
-            c.execute("SELECT id, name, roll, face_encoding FROM students")
-            students = c.fetchall()
-            
-            for student in students:
-                student_id, name, roll, encoding_blob = student
-                if encoding_blob:
-                    encoding = np.frombuffer(encoding_blob, dtype=np.float64)
-                    known_encodings.append(encoding)
-                    known_ids.append(student_id)
-            
-            # Find faces in the frame
-            face_locations = face_recognition.face_locations(frame)
-            face_encodings = face_recognition.face_encodings(frame, face_locations)
-            
-            if not face_encodings:
-                return jsonify({"success": False, "message": "No face detected in the image"})
-            
-            # Check if the face matches any known faces
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces(known_encodings, face_encoding)
+            # Only a bounded number of scans run at once; the rest queue briefly or are told to retry
+            with scan_admission.admit():
+                # Accept a raw image body, a multipart blob or the legacy base64 JSON payload
+                try:
+                    image_bytes = read_frame_bytes(request, max_bytes=current_app.config['MAX_FRAME_BYTES'])
+                except FrameError as e:
+                    return jsonify({"success": False, "message": str(e)})
+                data = request_params(request)
                 
-                if True in matches:
-                    match_index = matches.index(True)
-                    student_id = known_ids[match_index]
-                    
-                    # Get student details
-                    c.execute("SELECT name, roll FROM students WHERE id = ?", (student_id,))
-                    student = c.fetchone()
-                    name, roll = student
-                    
-                    # Check if already marked attendance today
-                    today = datetime.datetime.now().strftime("%Y-%m-%d")
-                    c.execute("SELECT id FROM attendance WHERE student_id = ? AND date(timestamp) = ?", 
-                              (student_id, today))
-                    
-                    if c.fetchone():
-                        return jsonify({"success": True, "message": f"Attendance already marked for {name} (Roll: {roll})"})
-                    
-                    # Mark attendance
-                    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    c.execute("INSERT INTO attendance (student_id, timestamp) VALUES (?, ?)", 
-                              (student_id, timestamp))
-                    conn.commit()
-                    
-                    return jsonify({"success": True, "message": f"Attendance marked for {name} (Roll: {roll})"})
-            
-            return jsonify({"success": False, "message": "Face not recognized"})
+                body, status = scan_frame(image_bytes, data, current_app.config, cache_scope=kiosk_id())
+                return jsonify(body), status
             
+        except Overloaded as e:
+            return jsonify({"success": False, "message": str(e), "retry_after": e.retry_after}), 429, \
+                {"Retry-After": str(e.retry_after)}
         except Exception as e:
             return jsonify({"success": False, "message": f"Error: {str(e)}"})
-        finally:
-            if 'conn' in locals():
-                conn.close()
     
     # For GET requests (render the page)
-    return render_template("index.html")
+    return render_template("index.html", jpeg_quality=current_app.config['SCAN_JPEG_QUALITY'],
+                           stream_fps=current_app.config['STREAM_FPS'])
+
+
+@attendance_bp.route("/stream/<session_id>", methods=["POST", "DELETE"])
+def stream_scan(session_id):
+    """
+    Continuous scanning: the kiosk keeps POSTing low-rate frames for its
+    session over one keep-alive connection, and each reply lists the faces
+    being tracked. DELETE ends the session.
+    """
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    if request.method == "DELETE":
+        stream_sessions.end(session_id)
+        return jsonify({"success": True})
+
+    try:
+        with scan_admission.admit():
+            try:
+                image_bytes = read_frame_bytes(request, max_bytes=current_app.config['MAX_FRAME_BYTES'])
+            except FrameError as e:
+                return jsonify({"success": False, "message": str(e)})
+            body, status = stream_frame(stream_sessions.get(session_id), image_bytes,
+                                        request_params(request), current_app.config)
+            return jsonify(body), status
+    except Overloaded as e:
+        return jsonify({"success": False, "message": str(e), "retry_after": e.retry_after}), 429, \
+            {"Retry-After": str(e.retry_after)}
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error: {str(e)}"})
+
+
+@attendance_bp.route("/scan/jobs", methods=["POST"])
+def submit_scan_job():
+    """
+    Queue a frame for recognition and return its job id straight away.
+    Takes the same image and options as /scan, plus an optional callback_url.
+    """
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    try:
+        image_bytes = read_frame_bytes(request, max_bytes=current_app.config['MAX_FRAME_BYTES'])
+    except FrameError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    data = request_params(request)
+
+    callback_url = data.pop('callback_url', None)
+    if callback_url and not scan_jobs.callback_allowed(callback_url):
+        return jsonify({"success": False, "message": "Callback host is not allowed"}), 400
+
+    try:
+        job, deduplicated = scan_jobs.submit(image_bytes, data, current_app.config, callback_url, kiosk_id())
+    except JobsFull as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+
+    job.update({
+        "success": True,
+        "deduplicated": deduplicated,
+        "status_url": url_for("attendance.scan_job", job_id=job["job_id"]),
+        "events_url": url_for("attendance.scan_job_events", job_id=job["job_id"]),
+    })
+    return jsonify(job), 202
+
+
+@attendance_bp.route("/scan/jobs/<job_id>")
+def scan_job(job_id):
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown or expired job"}), 404
+    return jsonify(job)
+
+
+@attendance_bp.route("/scan/jobs/<job_id>/events")
+def scan_job_events(job_id):
+    """Server-sent events: one event per status change, ending once the job has finished."""
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown or expired job"}), 404
+
+    timeout = current_app.config['RECOGNITION_JOB_TIMEOUT'] * 2
+
+    def events(job):
+        while job is not None:
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            if job["finished"] is not None:
+                return
+            job = scan_jobs.wait(job_id, job["status"], timeout)
+
+    return Response(stream_with_context(events(job)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@attendance_bp.route("/metrics")
+def metrics():
+    if "admin" not in session:
+        return redirect(url_for("admin.login"))
+
+    return jsonify({
+        "gallery": gallery.stats(),
+        "index": face_index.stats(),
+        "detection": detection_stats(),
+        "workers": recognition_pool.stats(),
+        "jobs": scan_jobs.stats(),
+        "admission": scan_admission.stats(),
+        "streams": stream_sessions.stats(),
+        "frame_cache": frame_cache.stats(),
+        "presence": presence.stats(),
+        "attendance_writer": attendance_writer.stats(),
+        "dashboard": dashboard_stats.stats(),
+        "exports": export_stats.stats(),
+        "imports": import_stats.stats(),
+    })
+
+
+def logs_page(req_date, cursor=None, limit=None):
+    """One keyset page of attendance logs, newest first: (rows, next_cursor)."""
+    conn = get_db_conn(readonly=True)
+    try:
+        return keyset_page(conn, LOGS_SELECT, ["a.day = ?"] if req_date else [], [req_date] if req_date else [],
+                           LOGS_KEYS, cursor, limit, descending=True)
+    finally:
+        conn.close()
 
 
 @attendance_bp.route("/logs")
@@ -136,34 +244,37 @@ def view_logs():
     if "admin" not in session:
         return redirect(url_for("admin.login"))
 
-    # Get date from request, default to today
-    import datetime
+    # Get date from request, default to today; an empty date pages through all records
     req_date = request.args.get('date', datetime.date.today().strftime('%Y-%m-%d'))
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit'))
 
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # If date is provided, filter by date
-    if req_date:
-        c.execute("""
-            SELECT a.id, s.name, s.roll, a.timestamp 
-            FROM attendance a 
-            JOIN students s ON a.student_id = s.id 
-            WHERE date(a.timestamp) = ? 
-            ORDER BY a.timestamp DESC
-        """, (req_date,))
-    else:
-        c.execute("""
-            SELECT a.id, s.name, s.roll, a.timestamp 
-            FROM attendance a 
-            JOIN students s ON a.student_id = s.id 
-            ORDER BY a.timestamp DESC
-        """)
-    
-    records = c.fetchall()
-    conn.close()
+    try:
+        records, next_cursor = logs_page(req_date, cursor, limit)
+    except CursorError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('attendance.view_logs', date=req_date))
+
+    return render_template("attendance.html", records=records, req_date=req_date,
+                           cursor=cursor, next_cursor=next_cursor, limit=limit)
+
+
+@attendance_bp.route("/api/logs")
+def api_logs():
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    try:
+        records, next_cursor = logs_page(request.args.get('date', ''), request.args.get('cursor'),
+                                         request.args.get('limit'))
+    except CursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-    return render_template("attendance.html", records=records, req_date=req_date)
+    return jsonify({
+        "success": True,
+        "records": [{"id": r[0], "name": r[1], "roll": r[2], "timestamp": r[3]} for r in records],
+        "next_cursor": next_cursor,
+    })
 
 @attendance_bp.route("/register", methods=["GET", "POST"])
 def register_student():
@@ -182,27 +293,16 @@ def register_student():
                 # Validate file type
                 if image_file and allowed_file(image_file.filename):
                     # Process the uploaded image
-                    image = Image.open(image_file)
+                    image_bytes = image_file.read()
+                    image = Image.open(BytesIO(image_bytes))
                     
-                    # Convert to numpy array for face_recognition
-                    image_np = np.array(image)
-                    
-                    # Check if RGB (convert if not)
-                    if len(image_np.shape) == 2:
-                        # Convert grayscale to RGB
-                        image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
-                    elif image_np.shape[2] == 4:
-                        # Convert RGBA to RGB
-                        image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
-                    
-                    # Detect faces
-                    face_locations = face_recognition.face_locations(image_np)
+                    # Detect and encode in a recognition worker process
+                    face_locations, face_encodings = recognition_pool.run(encode_image, image_bytes)
                     if not face_locations:
                         flash("No face detected in the uploaded image. Please try again with a clearer photo.", "error")
                         return render_template("register.html")
                         
-                    # Generate face encoding
-                    face_encoding = face_recognition.face_encodings(image_np, face_locations)[0]
+                    face_encoding = face_encodings[0]
                     
                     # Save the image file
                     os.makedirs(KNOWN_FACES_DIR, exist_ok=True)
@@ -229,6 +329,7 @@ def register_student():
                     c.execute("INSERT INTO students (id, name, roll, class, section, face_encoding) VALUES (?, ?, ?, ?, ?, ?)", 
                             (next_id, name, roll, class_name, section, face_encoding.tobytes()))
                     conn.commit()
+                    gallery.upsert(conn, next_id)
                     conn.close()
                     
                     flash(f'Student {name} (Roll: {roll}, Class: {class_name}, Section: {section}) registered successfully with ID: {next_id}', 'success')
@@ -236,39 +337,31 @@ def register_student():
                 else:
                     flash('Please upload a valid image file (PNG, JPG, JPEG)', 'error')
             # Check if image was captured via webcam (sent as base64)
-            elif 'capturedImage' in request.form and request.form['capturedImage']:
+            elif 'capturedImage' in request.files or request.form.get('capturedImage'):
                 try:
-                    # Get the base64 image data
-                    image_data = request.form['capturedImage']
-                    # Remove the data URL prefix if present
-                    if 'data:image' in image_data:
-                        image_data = image_data.split(',')[1]
-                    
-                    # Decode base64 to binary
-                    image_binary = base64.b64decode(image_data)
+                    if 'capturedImage' in request.files:
+                        # Binary JPEG blob from canvas.toBlob
+                        image_bytes = request.files['capturedImage'].read()
+                    else:
+                        # Legacy base64 data URL
+                        image_data = request.form['capturedImage']
+                        # Remove the data URL prefix if present
+                        if 'data:image' in image_data:
+                            image_data = image_data.split(',')[1]
+                        
+                        # Decode base64 to binary
+                        image_bytes = base64.b64decode(image_data)
                     
                     # Open as PIL Image
-                    image = Image.open(BytesIO(image_binary))
-                    
-                    # Convert to numpy array for face_recognition
-                    image_np = np.array(image)
-                    
-                    # Check if RGB (convert if not)
-                    if len(image_np.shape) == 2:
-                        # Convert grayscale to RGB
-                        image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
-                    elif image_np.shape[2] == 4:
-                        # Convert RGBA to RGB
-                        image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
+                    image = Image.open(BytesIO(image_bytes))
                     
-                    # Detect faces
-                    face_locations = face_recognition.face_locations(image_np)
+                    # Detect and encode in a recognition worker process
+                    face_locations, face_encodings = recognition_pool.run(encode_image, image_bytes)
                     if not face_locations:
                         flash("No face detected in the captured image. Please try again with a clearer photo.", "error")
                         return render_template("register.html")
                         
-                    # Generate face encoding
-                    face_encoding = face_recognition.face_encodings(image_np, face_locations)[0]
+                    face_encoding = face_encodings[0]
                     
                     # Save the image file
                     os.makedirs(KNOWN_FACES_DIR, exist_ok=True)
@@ -295,6 +388,7 @@ def register_student():
                     c.execute("INSERT INTO students (id, name, roll, class, section, face_encoding) VALUES (?, ?, ?, ?, ?, ?)", 
                             (next_id, name, roll, class_name, section, face_encoding.tobytes()))
                     conn.commit()
+                    gallery.upsert(conn, next_id)
                     conn.close()
                     
                     flash(f'Student {name} (Roll: {roll}, Class: {class_name}, Section: {section}) registered successfully with ID: {next_id}', 'success')
@@ -309,6 +403,18 @@ def register_student():
             
     return render_template("register.html")
 
+def students_page(conn, class_filter='', section_filter='', cursor=None, limit=None):
+    """One keyset page of students in name order: (rows, next_cursor)."""
+    conditions, params = [], []
+    if class_filter:
+        conditions.append("class = ?")
+        params.append(class_filter)
+    if section_filter:
+        conditions.append("section = ?")
+        params.append(section_filter)
+    return keyset_page(conn, STUDENTS_SELECT, conditions, params, STUDENTS_KEYS, cursor, limit)
+
+
 @attendance_bp.route("/students")
 def students():
     if "admin" not in session:
@@ -320,6 +426,8 @@ def students():
     # Get filter parameters
     class_filter = request.args.get('class', '')
     section_filter = request.args.get('section', '')
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit'))
     
     # Get all classes and sections for filter dropdowns
     c.execute("SELECT DISTINCT class FROM students WHERE class IS NOT NULL AND class != '' ORDER BY class")
@@ -328,28 +436,39 @@ def students():
     c.execute("SELECT DISTINCT section FROM students WHERE section IS NOT NULL AND section != '' ORDER BY section")
     sections = [row[0] for row in c.fetchall()]
     
-    # Apply filters if provided
-    query = "SELECT id, name, roll, class, section FROM students"
-    params = []
-    
-    if class_filter and section_filter:
-        query += " WHERE class = ? AND section = ?"
-        params.extend([class_filter, section_filter])
-    elif class_filter:
-        query += " WHERE class = ?"
-        params.append(class_filter)
-    elif section_filter:
-        query += " WHERE section = ?"
-        params.append(section_filter)
-    
-    query += " ORDER BY name"
-    
-    c.execute(query, params)
-    students = c.fetchall()
+    # Apply filters if provided, one page at a time
+    try:
+        students, next_cursor = students_page(conn, class_filter, section_filter, cursor, limit)
+    except CursorError as e:
+        conn.close()
+        flash(str(e), 'error')
+        return redirect(url_for('attendance.students', **{'class': class_filter, 'section': section_filter}))
     conn.close()
     
     return render_template("students.html", students=students, classes=classes, sections=sections, 
-                           class_filter=class_filter, section_filter=section_filter)
+                           class_filter=class_filter, section_filter=section_filter,
+                           cursor=cursor, next_cursor=next_cursor, limit=limit)
+
+
+@attendance_bp.route("/api/students")
+def api_students():
+    if "admin" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    conn = get_db_conn(readonly=True)
+    try:
+        students, next_cursor = students_page(conn, request.args.get('class', ''), request.args.get('section', ''),
+                                              request.args.get('cursor'), request.args.get('limit'))
+    except CursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    finally:
+        conn.close()
+
+    return jsonify({
+        "success": True,
+        "students": [{"id": s[0], "name": s[1], "roll": s[2], "class": s[3], "section": s[4]} for s in students],
+        "next_cursor": next_cursor,
+    })
 
 @attendance_bp.route("/student/<int:student_id>")
 def view_student(student_id):
@@ -368,10 +487,7 @@ def view_student(student_id):
         return "Student not found", 404
     
     # Get student's attendance records
-    c.execute("""SELECT a.timestamp 
-               FROM attendance a 
-               WHERE a.student_id = ? 
-               ORDER BY a.timestamp DESC""", (student_id,))
+    c.execute(STUDENT_HISTORY, (student_id,))
     attendance_records = c.fetchall()
     
     conn.close()
@@ -485,6 +601,7 @@ def edit_student(student_id):
             c.execute("UPDATE students SET name = ?, roll = ?, class = ?, section = ? WHERE id = ?", 
                      (name, roll, class_name, section, student_id))
             conn.commit()
+            gallery.upsert(conn, student_id)
             
             # Rename image file if it exists
             old_image_filename = f"{old_name}_{old_roll}.jpg"
@@ -526,6 +643,7 @@ def delete_student(student_id):
     # Delete student record
     c.execute("DELETE FROM students WHERE id = ?", (student_id,))
     conn.commit()
+    gallery.remove(conn, student_id)
     conn.close()
     
     # Remove student image if exists
@@ -1,15 +1,38 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash
-import sqlite3
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash, current_app
 import datetime
+import hmac
 import os
 import json
-from .db import DB_PATH
+from .db import get_db_conn
+from .dashboard import dashboard_stats
+from .rollups import attendance_summary
+from .exports import stream_csv, stream_columnar, wants_gzip
+from .pagination import CursorError, keyset_page, page_size
+from .imports import RecordError, parse_ndjson, run_import
+from .changelog import acknowledge, changes_since, current_versions, peer_marks, pending_counts
 
 # --- Blueprint setup ---
 gov_bp = Blueprint('gov', __name__, url_prefix='/gov')
 
-def get_db_conn():
-    return sqlite3.connect(DB_PATH)
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# A day's report, paged newest first by (ts, id); a row without ts sorts last, as ts 0
+REPORTS_SELECT = """
+    SELECT s.id, s.name, s.roll, s.class, s.section, a.timestamp, a.ts, a.id, IFNULL(a.ts, 0) 
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.id 
+"""
+REPORTS_KEYS = [("IFNULL(a.ts, 0)", 8), ("a.id", 7)]
+
+# CSV export of a date range
+EXPORT_RANGE = """
+    SELECT s.id, s.name, s.roll, s.class, s.section, a.timestamp 
+    FROM attendance a 
+    JOIN students s ON a.student_id = s.id 
+    WHERE a.day BETWEEN ? AND ? 
+    ORDER BY a.ts DESC
+"""
+EXPORT_RANGE_HEADER = ['ID', 'Name', 'Roll Number', 'Class', 'Section', 'Timestamp']
 
 # --- Authentication ---
 @gov_bp.route('/login', methods=['GET', 'POST'])
@@ -39,55 +62,20 @@ def dashboard():
     if 'gov' not in session:
         return redirect(url_for('gov.login'))
     
-    # Get statistics for dashboard
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # Get student count
-    c.execute("SELECT COUNT(*) FROM students")
-    student_count = c.fetchone()[0]
-    
-    # Get today's attendance count
-    today = datetime.date.today().strftime('%Y-%m-%d')
-    c.execute("SELECT COUNT(*) FROM attendance WHERE date(timestamp) = ?", (today,))
-    today_attendance = c.fetchone()[0]
-    
-    # Get total records
-    c.execute("SELECT COUNT(*) FROM attendance")
-    total_records = c.fetchone()[0]
-    
-    # Get attendance by class
-    c.execute("""
-        SELECT s.class, COUNT(a.id) as count 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) = ? 
-        GROUP BY s.class
-    """, (today,))
-    class_attendance = c.fetchall()
-    
-    # Get sync statistics
-    c.execute("SELECT COUNT(*) FROM students WHERE synced = 1")
-    students_synced = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM attendance WHERE synced = 1")
-    attendance_synced = c.fetchone()[0]
-    
-    # Get last sync time
-    c.execute("SELECT MAX(sync_timestamp) FROM sync_log")
-    last_sync_result = c.fetchone()[0]
-    last_sync = last_sync_result if last_sync_result else 'Never'
-    
+    # Gov pages only read, through a read-only connection that never holds up attendance writes.
+    # The counters come from the per-worker cache, refreshed only after the data changed.
+    conn = get_db_conn(readonly=True)
+    stats = dashboard_stats.get(conn)
     conn.close()
     
     return render_template('gov_dashboard.html', 
-                           student_count=student_count,
-                           today_attendance=today_attendance,
-                           total_records=total_records,
-                           class_attendance=class_attendance,
-                           students_synced=students_synced,
-                           attendance_synced=attendance_synced,
-                           last_sync=last_sync)
+                           student_count=stats['student_count'],
+                           today_attendance=stats['today_attendance'],
+                           total_records=stats['total_records'],
+                           class_attendance=stats['class_attendance'],
+                           students_synced=stats['students_synced'],
+                           attendance_synced=stats['attendance_synced'],
+                           last_sync=stats['last_sync'] or 'Never')
 
 # --- Sync Status ---
 @gov_bp.route('/sync_status')
@@ -95,37 +83,29 @@ def sync_status():
     if 'gov' not in session:
         return redirect(url_for('gov.login'))
     
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # Get sync statistics
-    c.execute("SELECT COUNT(*) FROM students WHERE synced = 1")
-    students_synced = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM attendance WHERE synced = 1")
-    attendance_synced = c.fetchone()[0]
-    
-    # Get last sync time
-    c.execute("SELECT MAX(sync_timestamp) FROM sync_log")
-    last_sync = c.fetchone()[0]
-    
-    # Get unsynced counts
-    c.execute("SELECT COUNT(*) FROM students WHERE synced = 0")
-    unsynced_students = c.fetchone()[0]
-    
-    c.execute("SELECT COUNT(*) FROM attendance WHERE synced = 0")
-    unsynced_attendance = c.fetchone()[0]
-    
+    conn = get_db_conn(readonly=True)
+    stats = dashboard_stats.get(conn)
     conn.close()
     
     return render_template('gov_sync.html',
-                           students_synced=students_synced,
-                           attendance_synced=attendance_synced,
-                           last_sync=last_sync if last_sync else 'Never',
-                           unsynced_students=unsynced_students,
-                           unsynced_attendance=unsynced_attendance)
+                           students_synced=stats['students_synced'],
+                           attendance_synced=stats['attendance_synced'],
+                           last_sync=stats['last_sync'] or 'Never',
+                           unsynced_students=stats['unsynced_students'],
+                           unsynced_attendance=stats['unsynced_attendance'])
 
 # --- Attendance Reports ---
+def reports_page(conn, req_date, class_filter='', section_filter='', cursor=None, limit=None):
+    """One keyset page of a day's attendance, latest check-in first: (rows, next_cursor)."""
+    conditions, params = ["a.day = ?"], [req_date]
+    if class_filter:
+        conditions.append("s.class = ?")
+        params.append(class_filter)
+    if section_filter:
+        conditions.append("s.section = ?")
+        params.append(section_filter)
+    return keyset_page(conn, REPORTS_SELECT, conditions, params, REPORTS_KEYS, cursor, limit, descending=True)
+
 @gov_bp.route('/reports')
 def reports():
     if 'gov' not in session:
@@ -137,101 +117,143 @@ def reports():
     # Get class filter if provided
     class_filter = request.args.get('class', '')
     section_filter = request.args.get('section', '')
+    cursor = request.args.get('cursor')
+    limit = page_size(request.args.get('limit'))
     
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # Base query
-    query = """
-        SELECT s.id, s.name, s.roll, s.class, s.section, a.timestamp 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) = ? 
-    """
-    params = [req_date]
-    
-    # Add filters if provided
-    if class_filter:
-        query += " AND s.class = ? "
-        params.append(class_filter)
-    if section_filter:
-        query += " AND s.section = ? "
-        params.append(section_filter)
-    
-    # Add order by
-    query += " ORDER BY a.timestamp DESC"
-    
-    # Execute query
-    c.execute(query, params)
-    records = c.fetchall()
-    
-    # Get available classes and sections for filters
-    c.execute("SELECT DISTINCT class FROM students ORDER BY class")
-    classes = [row[0] for row in c.fetchall()]
+    conn = get_db_conn(readonly=True)
+    try:
+        records, next_cursor = reports_page(conn, req_date, class_filter, section_filter, cursor, limit)
+    except CursorError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('gov.reports', date=req_date))
+    finally:
+        conn.close()
     
-    c.execute("SELECT DISTINCT section FROM students ORDER BY section")
-    sections = [row[0] for row in c.fetchall()]
+    return render_template('gov_reports.html', records=records, req_date=req_date,
+                           class_filter=class_filter, section_filter=section_filter,
+                           cursor=cursor, next_cursor=next_cursor, limit=limit)
+
+@gov_bp.route('/api/reports')
+def api_reports():
+    if 'gov' not in session:
+        return jsonify({"error": "Not logged in"}), 401
     
-    conn.close()
+    conn = get_db_conn(readonly=True)
+    try:
+        records, next_cursor = reports_page(conn, request.args.get('date', datetime.date.today().strftime('%Y-%m-%d')),
+                                            request.args.get('class', ''), request.args.get('section', ''),
+                                            request.args.get('cursor'), request.args.get('limit'))
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        conn.close()
     
-    return render_template('gov_reports.html', records=records, req_date=req_date)
+    return jsonify({
+        "records": [{"student_id": r[0], "name": r[1], "roll": r[2], "class": r[3], "section": r[4],
+                     "timestamp": r[5]} for r in records],
+        "next_cursor": next_cursor,
+    })
 
 # --- API for data import ---
 @gov_bp.route('/api/import', methods=['POST'])
 def import_data():
     # This would be secured with proper API authentication in production
+    # An NDJSON body (one record per line) is imported as it streams in; a JSON body is read whole
+    ndjson = request.mimetype in NDJSON_MIMETYPES
+    if not ndjson and not request.is_json:
+        return jsonify({"error": "Request must be JSON or NDJSON"}), 400
+    
+    if ndjson:
+        records = parse_ndjson(request.stream)
+        key = request.headers.get('Idempotency-Key') or request.args.get('idempotency_key')
+    else:
+        data = request.get_json()
+        if 'attendance_records' not in data:
+            return jsonify({"error": "No attendance records provided"}), 400
+        records = enumerate(data['attendance_records'], 1)
+        key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    
+    conn = get_db_conn()
+    progress = {}
+    try:
+        run_import(conn, records, key, current_app.config['IMPORT_BATCH_SIZE'], progress)
+    except RecordError as e:
+        # Batches before the bad record are committed; a retry with the same key resumes after them
+        return jsonify({"error": str(e), "line": e.line, **progress}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), **progress}), 500
+    finally:
+        conn.close()
+    
+    return jsonify({
+        "success": True,
+        "message": f"Successfully imported {progress['imported']} attendance records",
+        "replayed": progress["batches"] > 0 and progress["replayed_batches"] == progress["batches"],
+        **progress,
+    })
+
+# --- Delta sync ---
+def _sync_authorized():
+    # A logged-in gov user, or a peer presenting the shared SYNC_TOKEN; no token configured means no peers
+    if 'gov' in session:
+        return True
+    token = current_app.config['SYNC_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Sync-Token', ''), token)
+
+@gov_bp.route('/api/changes')
+def changes():
+    # Rows changed since the peer's acknowledged marks; ?since_<table>= overrides a mark, e.g. to resume a page
+    if not _sync_authorized():
+        return jsonify({"error": "Not authorized"}), 401
+    
+    peer = request.args.get('peer', current_app.config['SYNC_PEER'])
+    limit = request.args.get('limit', type=int)
+    conn = get_db_conn(readonly=True)
+    try:
+        marks = peer_marks(conn, peer)
+        for name in marks:
+            marks[name] = request.args.get(f'since_{name}', marks[name], type=int)
+        delta = changes_since(conn, marks, limit)
+        versions = current_versions(conn)
+    finally:
+        conn.close()
+    
+    return jsonify({
+        "peer": peer,
+        "changes": delta,
+        "pending": {name: versions[name] - delta[name]["version"] for name in delta},
+    })
+
+@gov_bp.route('/api/changes/ack', methods=['POST'])
+def acknowledge_changes():
+    # Called by the peer once it has stored a delta, with the versions the delta returned
+    if not _sync_authorized():
+        return jsonify({"error": "Not authorized"}), 401
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 400
     
     data = request.get_json()
-    
-    if 'attendance_records' not in data:
-        return jsonify({"error": "No attendance records provided"}), 400
+    peer = data.get('peer', current_app.config['SYNC_PEER'])
+    try:
+        versions = {name: int(version) for name, version in data.get('versions', {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"error": "versions must map table names to version numbers"}), 400
     
     conn = get_db_conn()
-    c = conn.cursor()
-    
     try:
-        # Begin transaction
-        conn.execute('BEGIN TRANSACTION')
-        
-        records_added = 0
-        for record in data['attendance_records']:
-            # Check if student exists by roll number
-            c.execute("SELECT id FROM students WHERE roll = ?", (record['roll'],))
-            student = c.fetchone()
-            
-            if not student:
-                # Add student if not exists (without face encoding)
-                c.execute("""
-                    INSERT INTO students (name, roll, class, section) 
-                    VALUES (?, ?, ?, ?)
-                """, (record['name'], record['roll'], record['class'], record['section']))
-                student_id = c.lastrowid
-            else:
-                student_id = student[0]
-            
-            # Add attendance record
-            c.execute("""
-                INSERT INTO attendance (student_id, timestamp) 
-                VALUES (?, ?)
-            """, (student_id, record['timestamp']))
-            
-            records_added += 1
-        
-        # Commit transaction
+        acknowledged = acknowledge(conn, peer, versions)
+        if acknowledged:
+            conn.execute("INSERT INTO sync_log (sync_timestamp, records_synced) VALUES (?, ?)",
+                         (datetime.datetime.now().isoformat(), acknowledged))
         conn.commit()
-        
-        return jsonify({
-            "success": True,
-            "message": f"Successfully imported {records_added} attendance records"
-        })
-        
+        pending = pending_counts(conn, peer)
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
+    
+    return jsonify({"success": True, "acknowledged": acknowledged, "pending": pending})
 
 # --- Analytics ---
 @gov_bp.route('/analytics')
@@ -244,52 +266,11 @@ def analytics():
     start_date = request.args.get('start_date', (today.replace(day=1)).strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
     
-    conn = get_db_conn()
+    conn = get_db_conn(readonly=True)
     c = conn.cursor()
     
-    # Get daily attendance counts
-    c.execute("""
-        SELECT date(timestamp) as date, COUNT(*) as count 
-        FROM attendance 
-        WHERE date(timestamp) BETWEEN ? AND ? 
-        GROUP BY date(timestamp) 
-        ORDER BY date(timestamp)
-    """, (start_date, end_date))
-    daily_counts = c.fetchall()
-    
-    # Get attendance by class
-    c.execute("""
-        SELECT s.class, COUNT(a.id) as count 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) BETWEEN ? AND ? 
-        GROUP BY s.class 
-        ORDER BY count DESC
-    """, (start_date, end_date))
-    class_attendance = c.fetchall()
-    
-    # Get attendance by section
-    c.execute("""
-        SELECT s.section, COUNT(a.id) as count 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) BETWEEN ? AND ? 
-        GROUP BY s.section 
-        ORDER BY count DESC
-    """, (start_date, end_date))
-    section_attendance = c.fetchall()
-    
-    # Get attendance trend by hour
-    c.execute("""
-        SELECT strftime('%H', timestamp) as hour, COUNT(*) as count 
-        FROM attendance 
-        WHERE date(timestamp) BETWEEN ? AND ? 
-        GROUP BY hour 
-        ORDER BY hour
-    """, (start_date, end_date))
-    hourly_trend = c.fetchall()
-    
-    # We already have class_attendance and section_attendance, so we don't need these duplicate queries
+    # Daily, class, section and hourly counts, read from the pre-grouped rollup rows of the range
+    daily_counts, class_attendance, section_attendance, hourly_trend = attendance_summary(c, start_date, end_date)
     
     # Convert data for charts
     dates = [row[0] for row in daily_counts]
@@ -334,39 +315,14 @@ def export_data():
     start_date = request.args.get('start_date', (today.replace(day=1)).strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
     
-    conn = get_db_conn()
-    c = conn.cursor()
-    
-    # Get all attendance records in the date range
-    c.execute("""
-        SELECT s.id, s.name, s.roll, s.class, s.section, a.timestamp 
-        FROM attendance a 
-        JOIN students s ON a.student_id = s.id 
-        WHERE date(a.timestamp) BETWEEN ? AND ? 
-        ORDER BY a.timestamp DESC
-    """, (start_date, end_date))
-    records = c.fetchall()
-    
-    conn.close()
-    
-    # Create CSV content
-    import csv
-    import io
-    from flask import make_response
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['ID', 'Name', 'Roll Number', 'Class', 'Section', 'Timestamp'])
-    
-    # Write data
-    for record in records:
-        writer.writerow(record)
+    conn = get_db_conn(readonly=True)
     
-    # Create response
-    response = make_response(output.getvalue())
-    response.headers["Content-Disposition"] = f"attachment; filename=attendance_{start_date}_to_{end_date}.csv"
-    response.headers["Content-type"] = "text/csv"
+    # District-scale pulls can ask for the compact columnar format instead of CSV
+    if request.args.get('format') == 'columnar':
+        return stream_columnar(conn, start_date, end_date, f"attendance_{start_date}_to_{end_date}.attcol",
+                               block_rows=current_app.config['COLUMNAR_BLOCK_ROWS'])
     
-    return response
\ No newline at end of file
+    # Stream all attendance records in the date range, one batch of rows at a time
+    return stream_csv(conn, EXPORT_RANGE, (start_date, end_date), EXPORT_RANGE_HEADER,
+                      f"attendance_{start_date}_to_{end_date}.csv",
+                      gzip=wants_gzip(), batch_size=current_app.config['EXPORT_BATCH_SIZE'])
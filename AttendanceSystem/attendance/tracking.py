@@ -0,0 +1,171 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# Boxes in consecutive frames overlapping at least this much are the same face
+DEFAULT_IOU_THRESHOLD = 0.3
+DEFAULT_TRACK_TTL = 2.0
+DEFAULT_SESSION_TTL = 60.0
+DEFAULT_MAX_SESSIONS = 200
+# A face that did not match anyone is encoded again at most this often
+UNKNOWN_RETRY = 1.0
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    inter = (right - left) * (bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def associate(boxes, known_boxes, threshold=DEFAULT_IOU_THRESHOLD):
+    """
+    Greedily pair each box with the known box it overlaps most.
+
+    Returns one entry per box: the index into known_boxes, or None for a new face.
+    """
+    pairs = sorted(((iou(box, known), i, j) for i, box in enumerate(boxes) for j, known in enumerate(known_boxes)),
+                   reverse=True)
+    result = [None] * len(boxes)
+    taken = set()
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if result[i] is None and j not in taken:
+            result[i] = j
+            taken.add(j)
+    return result
+
+
+class Track:
+    """One face followed across a stream's frames, identified once."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box, now):
+        self.id = next(Track._ids)
+        self.box = box
+        self.last_seen = now
+        self.status = None
+        self.student_id = None
+        self.name = None
+        self.roll = None
+        self.identified_at = None
+
+    def needs_identity(self, now):
+        if self.status is None:
+            return True
+        return self.status == "unknown" and now - self.identified_at >= UNKNOWN_RETRY
+
+    def identify(self, status, now, student_id=None, name=None, roll=None):
+        self.status = status
+        self.identified_at = now
+        self.student_id, self.name, self.roll = student_id, name, roll
+
+    def to_dict(self, new=False):
+        top, right, bottom, left = self.box
+        result = {"track_id": self.id, "status": self.status, "new": new,
+                  "box": {"top": top, "right": right, "bottom": bottom, "left": left}}
+        if self.student_id is not None:
+            result.update({"student_id": self.student_id, "name": self.name, "roll": self.roll})
+        return result
+
+
+class StreamSession:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.last_seen = time.monotonic()
+
+    def settled_boxes(self, now):
+        """Boxes of live tracks that already have an identity and need no encoding."""
+        return [track.box for track in self.tracks if not track.needs_identity(now)]
+
+    def update(self, boxes, track_ttl, threshold=DEFAULT_IOU_THRESHOLD):
+        """
+        Move tracks to this frame's boxes, start tracks for new faces and drop
+        the ones not seen for track_ttl. Returns one (track, is_new) per box.
+        """
+        now = time.monotonic()
+        self.last_seen = now
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= track_ttl]
+
+        matched = associate(boxes, [track.box for track in self.tracks], threshold)
+        result = []
+        for box, index in zip(boxes, matched):
+            if index is None:
+                track = Track(box, now)
+                self.tracks.append(track)
+                result.append((track, True))
+            else:
+                track = self.tracks[index]
+                track.box, track.last_seen = box, now
+                result.append((track, False))
+        return result
+
+
+class StreamSessions:
+    """Per-kiosk track state for streaming scans, expired when a kiosk goes quiet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.track_ttl = DEFAULT_TRACK_TTL
+        self.session_ttl = DEFAULT_SESSION_TTL
+        self.max_sessions = DEFAULT_MAX_SESSIONS
+        self.stats_counters = {"frames": 0, "faces": 0, "tracks": 0, "encoded": 0, "identified": 0,
+                               "sessions_expired": 0}
+
+    def configure(self, track_ttl=None, session_ttl=None, max_sessions=None):
+        with self._lock:
+            if track_ttl is not None:
+                self.track_ttl = track_ttl
+            if session_ttl is not None:
+                self.session_ttl = session_ttl
+            if max_sessions is not None:
+                self.max_sessions = max_sessions
+
+    def get(self, session_id):
+        with self._lock:
+            now = time.monotonic()
+            # Least recently used first, so idle sessions are at the front
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                full = len(self._sessions) >= self.max_sessions and session_id not in self._sessions
+                if now - oldest.last_seen <= self.session_ttl and not full:
+                    break
+                del self._sessions[oldest_id]
+                self.stats_counters["sessions_expired"] += 1
+
+            session = self._sessions.pop(session_id, None) or StreamSession()
+            self._sessions[session_id] = session
+            return session
+
+    def end(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats_counters[name] += value
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result.update({
+                "sessions": len(self._sessions),
+                "track_ttl": self.track_ttl,
+                # How many face sightings were served from a track instead of dlib
+                "encodings_saved": result["faces"] - result["encoded"],
+            })
+        return result
+
+
+stream_sessions = StreamSessions()
@@ -0,0 +1,191 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_QUEUE_DEPTH = 8
+DEFAULT_JOB_TIMEOUT = 10.0
+
+
+class PoolBusy(Exception):
+    """Every worker is busy and the queue is full."""
+
+
+class RecognitionTimeout(Exception):
+    """A job did not finish within its deadline."""
+
+
+class PoolBroken(Exception):
+    """A worker process died (e.g. killed for memory); the next job starts a fresh pool."""
+
+
+# ---------- Jobs (run inside the worker processes) ----------
+
+def _warm_up():
+    # Loading dlib's models and the Haar cascade once per process keeps them off the request path
+    import face_recognition
+    from .detection import may_contain_face
+
+    blank = np.zeros((100, 100, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(10, 90, 90, 10)])
+    may_contain_face(blank)
+
+
+def recognize_frame(image_bytes, profile, prefilter):
+    """decode -> detect -> encode for one scan frame."""
+    from .detection import detect_faces
+    from .frames import decode_frame
+
+    return detect_faces(decode_frame(image_bytes), profile, prefilter)
+
+
+def encode_frame(image_bytes, profile, locations):
+    """decode -> encode at boxes already detected in a near-identical frame."""
+    from .detection import encode_faces
+    from .frames import decode_frame
+
+    return encode_faces(decode_frame(image_bytes), locations, profile)
+
+
+def recognize_stream_frame(image_bytes, profile, known_boxes, iou_threshold):
+    """decode -> detect -> encode only the faces a stream is not already tracking."""
+    from .detection import detect_new_faces
+    from .frames import decode_frame
+
+    return detect_new_faces(decode_frame(image_bytes), profile, known_boxes, iou_threshold)
+
+
+def encode_image(image_bytes):
+    """Full-resolution detection and encoding for a registration photo."""
+    import face_recognition
+    from .frames import decode_frame
+
+    rgb = decode_frame(image_bytes)
+    locations = face_recognition.face_locations(rgb)
+    return locations, face_recognition.face_encodings(rgb, locations) if locations else []
+
+
+# ---------- Pool (used by the web process) ----------
+
+class RecognitionPool:
+    """
+    Runs the CPU-bound dlib work in a pool of worker processes so a slow frame
+    never holds a web worker's thread. At most size + max_queue jobs are
+    outstanding; beyond that submissions fail fast with PoolBusy.
+    A size of 0 runs jobs inline in the calling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.size = DEFAULT_POOL_SIZE
+        self.max_queue = DEFAULT_QUEUE_DEPTH
+        self.timeout = DEFAULT_JOB_TIMEOUT
+        self._slots = threading.BoundedSemaphore(self.size + self.max_queue)
+        self.outstanding = 0
+        self.stats_counters = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "failures": 0}
+
+    def configure(self, size=None, max_queue=None, timeout=None):
+        with self._lock:
+            if size is not None:
+                self.size = size
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if timeout is not None:
+                self.timeout = timeout
+            self._slots = threading.BoundedSemaphore(max(1, self.size + self.max_queue))
+        self.shutdown()
+
+    def _get_executor(self):
+        # Started lazily so each gunicorn worker gets its own pool after forking
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_up,
+                )
+            return self._executor
+
+    def run(self, fn, *args, timeout=None):
+        """Run fn(*args) in the pool and wait for its result, or raise PoolBusy/RecognitionTimeout/PoolBroken."""
+        if self.size <= 0:
+            return fn(*args)
+
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self._count("rejected")
+            raise PoolBusy("Recognition workers are busy")
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next job
+            slots.release()
+            self._reset(executor)
+            self._count("failures")
+            raise PoolBroken("A recognition worker died")
+        except BaseException:
+            slots.release()
+            raise
+
+        self._count("submitted", outstanding=1)
+        # The slot is freed when the job really finishes, not when the caller gives up on it
+        future.add_done_callback(lambda _: self._finish(slots))
+
+        try:
+            result = future.result(timeout=timeout or self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count("timeouts")
+            raise RecognitionTimeout("Recognition took too long")
+        except BrokenProcessPool:
+            self._reset(executor)
+            self._count("failures")
+            raise PoolBroken("A recognition worker died")
+        self._count("completed")
+        return result
+
+    def _finish(self, slots):
+        slots.release()
+        self._count(outstanding=-1)
+
+    def _count(self, name=None, outstanding=0):
+        with self._lock:
+            if name:
+                self.stats_counters[name] += 1
+            self.outstanding += outstanding
+
+    def _reset(self, broken=None):
+        # With broken, only that executor is dropped, not a fresh one another job already started
+        with self._lock:
+            if broken is not None and self._executor is not broken:
+                return
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._reset()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result.update({
+                "size": self.size,
+                "max_queue": self.max_queue,
+                "outstanding": self.outstanding,
+                "queued": max(0, self.outstanding - self.size),
+                "timeout": self.timeout,
+            })
+        return result
+
+
+recognition_pool = RecognitionPool()
+atexit.register(recognition_pool.shutdown)
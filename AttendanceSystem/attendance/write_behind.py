@@ -0,0 +1,292 @@
+import atexit
+import queue
+import threading
+import time
+
+from .admission import _histogram, _labelled, _observe
+from .db import get_data_version, get_db_conn
+from .presence import presence
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_FLUSH_INTERVAL = 0.005
+DEFAULT_MAX_QUEUE = 1024
+# Longest a scan waits for room in a full queue before writing its own rows
+DEFAULT_ENQUEUE_TIMEOUT = 1.0
+# Longest a "commit" scan waits for its batch before writing its own rows (INSERT OR IGNORE makes that safe)
+DEFAULT_COMMIT_TIMEOUT = 5.0
+DURABILITY_MODES = ("commit", "enqueue")
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+COMMIT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+INSERT_ATTENDANCE = "INSERT OR IGNORE INTO attendance (student_id, timestamp, day, ts) VALUES (?, ?, ?, ?)"
+
+
+def insert_marks(conn, student_ids, timestamp, day, ts):
+    """INSERT OR IGNORE one row per student; returns the ids that got a new row."""
+    # The unique (student_id, day) index settles races between kiosks: only one insert creates a row
+    inserted = []
+    for student_id in student_ids:
+        if conn.execute(INSERT_ATTENDANCE, (student_id, timestamp, day, ts)).rowcount:
+            inserted.append(student_id)
+    return inserted
+
+
+class _Marks:
+    """One mark_attendance call waiting in the queue."""
+
+    __slots__ = ("student_ids", "timestamp", "day", "ts", "done", "inserted", "error")
+
+    def __init__(self, student_ids, timestamp, day, ts):
+        self.student_ids = student_ids
+        self.timestamp = timestamp
+        self.day = day
+        self.ts = ts
+        self.done = threading.Event()
+        self.inserted = []
+        self.error = None
+
+
+class AttendanceWriter:
+    """
+    Write-behind queue for attendance marks. Scans put their rows on a bounded
+    in-process queue and a single writer thread commits whatever has gathered,
+    up to batch_size rows or flush_interval seconds' worth, in one
+    transaction, so a burst of scans costs one commit instead of one each.
+
+    In "commit" durability a scan is answered only after its batch committed,
+    with the rows that really were new. In "enqueue" durability it is answered
+    as soon as its rows are queued; rows still waiting are remembered so a
+    repeat scan is not marked twice, and a crash can lose at most the queue.
+    When the queue is full for enqueue_timeout seconds, or a "commit" scan's
+    batch has not committed within commit_timeout seconds, the scan writes its
+    own rows instead. Remaining rows are flushed on shutdown.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pending = {}
+        self.enabled = False
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.max_queue = DEFAULT_MAX_QUEUE
+        self.durability = DURABILITY_MODES[0]
+        self.enqueue_timeout = DEFAULT_ENQUEUE_TIMEOUT
+        self.commit_timeout = DEFAULT_COMMIT_TIMEOUT
+        self.stats_counters = {"submitted": 0, "batches": 0, "rows": 0, "inserted": 0, "failed_batches": 0,
+                               "lost_rows": 0, "overflow_inline": 0, "timeout_inline": 0}
+        self.batch_histogram = _histogram(BATCH_BUCKETS)
+        self.commit_histogram = _histogram(COMMIT_BUCKETS_MS)
+        self.ack_histogram = _histogram(COMMIT_BUCKETS_MS)
+
+    def configure(self, enabled=None, batch_size=None, flush_interval=None, max_queue=None, durability=None,
+                  enqueue_timeout=None, commit_timeout=None):
+        if durability is not None and durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown write-behind durability: {durability}")
+        # Whatever the old settings queued is committed before they change
+        self.shutdown()
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if batch_size is not None:
+                self.batch_size = max(1, batch_size)
+            if flush_interval is not None:
+                self.flush_interval = flush_interval
+            if max_queue is not None:
+                self.max_queue = max(1, max_queue)
+            if durability is not None:
+                self.durability = durability
+            if enqueue_timeout is not None:
+                self.enqueue_timeout = enqueue_timeout
+            if commit_timeout is not None:
+                self.commit_timeout = commit_timeout
+
+    def _start(self):
+        # Started lazily so each gunicorn worker gets its own writer after forking
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.Queue(self.max_queue)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="attendance-writer",
+                                                daemon=True)
+                self._thread.start()
+            return self._queue
+
+    def submit(self, student_ids, timestamp, day, ts):
+        """Queue marks for student_ids; returns the ids that were (or, in enqueue mode, will be) newly marked."""
+        marks = _Marks(list(student_ids), timestamp, day, ts)
+        durable = self.durability == "commit"
+        if not durable:
+            with self._lock:
+                queued = self._pending.setdefault(day, set())
+                marks.student_ids = [student_id for student_id in marks.student_ids if student_id not in queued]
+                queued.update(marks.student_ids)
+            if not marks.student_ids:
+                return set()
+
+        started = time.perf_counter()
+        try:
+            self._start().put(marks, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Backpressure: the scan pays for its own commit rather than waiting on the writer
+            self._count("overflow_inline")
+            self._forget(marks)
+            return set(self._write_inline(marks))
+        self._count("submitted")
+
+        if not durable:
+            return set(marks.student_ids)
+        if not marks.done.wait(self.commit_timeout):
+            # The writer is stuck; whatever it commits later is ignored by the unique index
+            self._count("timeout_inline")
+            return set(self._write_inline(marks))
+        with self._lock:
+            _observe(self.ack_histogram, COMMIT_BUCKETS_MS, (time.perf_counter() - started) * 1000)
+        if marks.error is not None:
+            raise marks.error
+        return set(marks.inserted)
+
+    def _write_inline(self, marks):
+        conn = get_db_conn()
+        try:
+            day, version, _ = presence.marked_today(conn, marks.day)
+            inserted = insert_marks(conn, marks.student_ids, marks.timestamp, marks.day, marks.ts)
+            conn.commit()
+            presence.add(conn, day, version, inserted)
+            return inserted
+        finally:
+            conn.close()
+
+    def _run(self, marks_queue):
+        stopping = False
+        while not stopping:
+            first = marks_queue.get()
+            if first is None:
+                break
+            batch, rows = [first], len(first.student_ids)
+            deadline = time.monotonic() + self.flush_interval
+            while rows < self.batch_size:
+                try:
+                    marks = marks_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if marks is None:
+                    # Shutdown: commit what is already gathered, then stop
+                    stopping = True
+                    break
+                batch.append(marks)
+                rows += len(marks.student_ids)
+            self._commit(batch, rows)
+
+    def _commit(self, batch, rows):
+        # Whatever fails, every waiting scan is released by _finish and the writer thread keeps running
+        started = time.perf_counter()
+        conn = None
+        inserted_by_day = {}
+        failed = True
+        try:
+            try:
+                conn = get_db_conn()
+                # Take the write lock up front so the version read below is the one the inserts start from
+                conn.execute("BEGIN IMMEDIATE")
+                version = get_data_version(conn, "attendance")
+                for marks in batch:
+                    marks.inserted = insert_marks(conn, marks.student_ids, marks.timestamp, marks.day, marks.ts)
+                    inserted_by_day.setdefault(marks.day, []).extend(marks.inserted)
+                conn.commit()
+            except Exception as e:
+                for marks in batch:
+                    marks.error = e
+                inserted_by_day = {}
+                if conn is not None:
+                    conn.rollback()
+                return
+            failed = False
+
+            try:
+                # The presence set is patched only if this batch was the sole change since it was loaded
+                if len(inserted_by_day) == 1:
+                    (day, inserted), = inserted_by_day.items()
+                    presence.add(conn, day, version, inserted)
+                elif inserted_by_day:
+                    presence.invalidate()
+            except Exception:
+                # The rows are committed; a set that could not be patched is reloaded by the next scan
+                presence.invalidate()
+        finally:
+            if conn is not None:
+                conn.close()
+            self._finish(batch, rows, started, inserted=sum(map(len, inserted_by_day.values())), failed=failed)
+
+    def _finish(self, batch, rows, started, inserted=0, failed=False):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats_counters["batches"] += 1
+            self.stats_counters["rows"] += rows
+            self.stats_counters["inserted"] += inserted
+            if failed:
+                self.stats_counters["failed_batches"] += 1
+                if self.durability != "commit":
+                    self.stats_counters["lost_rows"] += rows
+            _observe(self.batch_histogram, BATCH_BUCKETS, rows)
+            _observe(self.commit_histogram, COMMIT_BUCKETS_MS, elapsed_ms)
+            for marks in batch:
+                queued = self._pending.get(marks.day)
+                if queued is not None:
+                    queued.difference_update(marks.student_ids)
+                    if not queued:
+                        del self._pending[marks.day]
+        for marks in batch:
+            marks.done.set()
+
+    def _forget(self, marks):
+        with self._lock:
+            queued = self._pending.get(marks.day)
+            if queued is not None:
+                queued.difference_update(marks.student_ids)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def shutdown(self):
+        """Commit everything still queued and stop the writer thread."""
+        with self._lock:
+            thread, marks_queue = self._thread, self._queue
+            self._thread = self._queue = None
+        if thread is not None and thread.is_alive():
+            marks_queue.put(None)
+            thread.join()
+            # Marks that raced in behind the stop signal are committed here rather than left waiting
+            leftovers = []
+            while True:
+                try:
+                    marks = marks_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if marks is not None:
+                    leftovers.append(marks)
+            if leftovers:
+                self._commit(leftovers, sum(len(marks.student_ids) for marks in leftovers))
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.stats_counters)
+            result.update({
+                "enabled": self.enabled,
+                "durability": self.durability,
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+                "max_queue": self.max_queue,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "avg_batch_rows": round(result["rows"] / result["batches"], 2) if result["batches"] else None,
+                "batch_rows_histogram": _labelled(self.batch_histogram, BATCH_BUCKETS),
+                "commit_ms_histogram": _labelled(self.commit_histogram, COMMIT_BUCKETS_MS),
+                "ack_ms_histogram": _labelled(self.ack_histogram, COMMIT_BUCKETS_MS),
+            })
+        return result
+
+
+attendance_writer = AttendanceWriter()
+atexit.register(attendance_writer.shutdown)
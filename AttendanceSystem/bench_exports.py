@@ -0,0 +1,42 @@
+import sqlite3
+import sys
+import time
+
+from attendance.columnar import EXPORT_QUERY, columnar_chunks
+from attendance.db import DB_PATH
+from attendance.exports import csv_chunks, gzip_chunks
+from attendance.routes_gov import EXPORT_RANGE, EXPORT_RANGE_HEADER
+
+def measure(chunks):
+    """Drain an export's byte chunks; returns (bytes, seconds)."""
+    started = time.perf_counter()
+    size = sum(len(chunk) for chunk in chunks)
+    return size, time.perf_counter() - started
+
+def benchmark(start_date, end_date):
+    """Size and time of the CSV, gzipped CSV and columnar exports of one date range."""
+    conn = sqlite3.connect(DB_PATH)
+    
+    def csv_bytes():
+        # The same query and header as the /gov/export_data CSV
+        cursor = conn.execute(EXPORT_RANGE, (start_date, end_date))
+        return (chunk.encode("utf-8") for chunk, _ in csv_chunks(cursor, EXPORT_RANGE_HEADER))
+    
+    rows = conn.execute("SELECT COUNT(*) FROM attendance WHERE day BETWEEN ? AND ?", (start_date, end_date)).fetchone()[0]
+    results = {
+        "csv": measure(csv_bytes()),
+        "csv+gzip": measure(gzip_chunks(csv_bytes())),
+        "columnar": measure(columnar_chunks(conn.execute(EXPORT_QUERY, (start_date, end_date)))),
+    }
+    conn.close()
+    
+    print(f"{rows} attendance records from {start_date} to {end_date}")
+    csv_size = results["csv"][0]
+    for name, (size, seconds) in results.items():
+        print(f"{name:10} {size:>12} bytes  {size / csv_size:6.1%} of csv  {seconds * 1000:9.1f} ms")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python bench_exports.py START_DATE END_DATE")
+        sys.exit(1)
+    benchmark(sys.argv[1], sys.argv[2])
@@ -0,0 +1,20 @@
+import os
+
+# Loaded by gunicorn from the working directory, so "gunicorn app:app" (Procfile, render.yaml) picks it up.
+# Scan admission control, the write-behind writer and the scan job event streams all work per process and
+# need concurrent requests inside it: with the default sync worker a process only ever has one request in
+# flight, so the admission queue, its 429 shedding and the kiosks' backoff could never trigger.
+worker_class = "gthread"
+
+# Enough threads for every admitted scan, every queued one and a few other requests (dashboards, streams)
+threads = int(os.environ.get(
+    "GUNICORN_THREADS",
+    int(os.environ.get("SCAN_MAX_IN_FLIGHT", 4)) + int(os.environ.get("SCAN_ADMISSION_QUEUE", 16)) + 4,
+))
+
+
+def on_starting(server):
+    # Create and migrate the database once, in the master, before any worker imports the app
+    from migrate_db import prepare_database
+
+    prepare_database()
@@ -1,5 +1,12 @@
 import sqlite3
 import os
+import sys
+
+from attendance.db import INDEXES, close_thread_db, init_db
+from attendance.query_plans import check_query_plans
+from attendance.rollups import ensure_rollups, rebuild_rollups
+from attendance.imports import ensure_import_log
+from attendance.changelog import ensure_change_log
 
 # Use absolute path for database to ensure persistence
 DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "instance", "attendance.db"))
@@ -33,9 +40,91 @@ def migrate_db():
     else:
         print("'synced' column already exists in attendance table.")
     
+    # Day key for the one-row-per-student-per-day constraint
+    if 'day' not in column_names:
+        print("Adding 'day' column to attendance table...")
+        cursor.execute("ALTER TABLE attendance ADD COLUMN day TEXT")
+        print("Column added successfully.")
+    else:
+        print("'day' column already exists in attendance table.")
+    
+    cursor.execute("UPDATE attendance SET day = date(timestamp) WHERE day IS NULL")
+    if cursor.rowcount:
+        print(f"Backfilled day for {cursor.rowcount} attendance records.")
+    
+    # Integer epoch seconds; timestamps were written in local time
+    if 'ts' not in column_names:
+        print("Adding 'ts' column to attendance table...")
+        cursor.execute("ALTER TABLE attendance ADD COLUMN ts INTEGER")
+        print("Column added successfully.")
+    else:
+        print("'ts' column already exists in attendance table.")
+    
+    cursor.execute("UPDATE attendance SET ts = strftime('%s', timestamp, 'utc') WHERE ts IS NULL")
+    if cursor.rowcount:
+        print(f"Backfilled ts for {cursor.rowcount} attendance records.")
+    
+    # Keep the first scan of each student per day, once: after that the unique index keeps duplicates out
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_attendance_student_day'")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            DELETE FROM attendance WHERE id NOT IN (
+                SELECT MIN(id) FROM attendance GROUP BY student_id, day
+            )
+        """)
+        if cursor.rowcount:
+            print(f"Removed {cursor.rowcount} duplicate attendance records.")
+    
+    # Replaced by idx_students_name_sort, which also orders students without a name
+    cursor.execute("DROP INDEX IF EXISTS idx_students_name")
+    
+    for statement in INDEXES:
+        cursor.execute(statement)
+    
+    # Analytics rollups, filled from the existing rows the first time
+    ensure_rollups(cursor)
+    
+    # Idempotency keys of /gov/api/import batches
+    ensure_import_log(cursor)
+    
+    # Change log for delta sync, started with every existing row the first time
+    ensure_change_log(cursor)
+    
     conn.commit()
     conn.close()
     print("Migration completed successfully.")
 
+def prepare_database():
+    """
+    Create the database, then bring an older one up to the current schema.
+    Run once per start, before any worker serves: gunicorn calls it from its
+    on_starting hook (gunicorn.conf.py), python app.py before it serves.
+    """
+    init_db()
+    migrate_db()
+    # The workers fork from here; none of them may inherit this process's connection
+    close_thread_db()
+
+def rebuild_analytics_rollups():
+    """Recompute the analytics rollups from the attendance table, e.g. after a bulk load with triggers off."""
+    conn = sqlite3.connect(DB_PATH)
+    groups = rebuild_rollups(conn.cursor())
+    conn.commit()
+    conn.close()
+    print(f"Rebuilt {groups} analytics rollup groups.")
+
+def print_query_plans():
+    """Print the plan of every hot query; exits non-zero if one no longer uses its index."""
+    conn = sqlite3.connect(DB_PATH)
+    results = check_query_plans(conn)
+    conn.close()
+    for name, (ok, plan) in results.items():
+        print(f"{'ok' if ok else 'SCAN'}  {name}: {' / '.join(plan)}")
+    return all(ok for ok, _ in results.values())
+
 if __name__ == "__main__":
-    migrate_db()
\ No newline at end of file
+    migrate_db()
+    if "--rebuild-rollups" in sys.argv:
+        rebuild_analytics_rollups()
+    if "--check-plans" in sys.argv and not print_query_plans():
+        sys.exit(1)
\ No newline at end of file
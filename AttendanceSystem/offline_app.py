@@ -7,8 +7,29 @@ import os
 import datetime
 import numpy as np
 import json
+import importlib.util
 from pathlib import Path
 
+
+def _load_helper(name):
+    """
+    Load attendance/<name>.py on its own. Importing it through the attendance
+    package would run the web app's package __init__ (Flask, the recognition
+    pool), which the offline app neither needs nor installs.
+    """
+    path = Path(__file__).resolve().parent / "attendance" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(f"offline_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+changelog = _load_helper("changelog")
+columnar = _load_helper("columnar")
+
+# Peer name the local change log keeps the web server's sync marks under
+SERVER_PEER = "server"
+
 class AttendanceApp:
     def __init__(self, root):
         self.root = root
@@ -59,6 +80,9 @@ class AttendanceApp:
                     records_synced INTEGER
                 )''')
         
+        # Change log the web sync ships deltas from
+        changelog.ensure_change_log(c)
+        
         conn.commit()
         conn.close()
     
@@ -222,10 +246,9 @@ class AttendanceApp:
         # Get counts of unsynced data
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM students WHERE synced = 0")
-        unsynced_students = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM attendance WHERE synced = 0")
-        unsynced_attendance = c.fetchone()[0]
+        pending = changelog.pending_counts(conn, SERVER_PEER)
+        unsynced_students = pending["students"]
+        unsynced_attendance = pending["attendance"]
         conn.close()
         
         self.unsynced_students_label = tk.Label(status_frame, text=str(unsynced_students))
@@ -241,6 +264,10 @@ class AttendanceApp:
         export_btn = tk.Button(action_frame, text="Export Data to JSON", command=self.export_to_json, width=20)
         export_btn.pack(side="left", padx=10)
         
+        # Compact columnar export for large pulls
+        columnar_btn = tk.Button(action_frame, text="Export Columnar", command=self.export_to_columnar, width=15)
+        columnar_btn.pack(side="left", padx=10)
+        
         # Sync button
         sync_btn = tk.Button(action_frame, text="Synchronize with Server", command=self.sync_with_server, width=20)
         sync_btn.pack(side="left", padx=10)
@@ -294,6 +321,35 @@ class AttendanceApp:
         except Exception as e:
             tk.messagebox.showerror("Export Error", f"Failed to export data: {str(e)}")
     
+    def export_to_columnar(self):
+        """Export attendance to a compact columnar file, streamed from the database in blocks"""
+        try:
+            export_dir = Path("./exports")
+            export_dir.mkdir(exist_ok=True)
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            attendance_file = export_dir / f"attendance_{timestamp}.attcol"
+            
+            # The local table may predate the day and ts columns, so both are derived from timestamp
+            conn = sqlite3.connect(self.db_path)
+            c = conn.cursor()
+            c.execute("""
+                SELECT a.student_id, s.roll, s.name, s.class, s.section,
+                       CAST(julianday(date(a.timestamp)) - 2440587.5 AS INTEGER),
+                       CAST(strftime('%s', a.timestamp, 'utc') AS INTEGER)
+                FROM attendance a 
+                JOIN students s ON a.student_id = s.id
+                WHERE date(a.timestamp) IS NOT NULL AND strftime('%s', a.timestamp, 'utc') IS NOT NULL
+                ORDER BY a.timestamp
+            """)
+            rows = columnar.write_columnar(c, attendance_file)
+            conn.close()
+            
+            tk.messagebox.showinfo("Export Successful",
+                                  f"Exported {rows} attendance records to:\n{attendance_file}")
+            
+        except Exception as e:
+            tk.messagebox.showerror("Export Error", f"Failed to export data: {str(e)}")
+    
     def sync_with_server(self):
         """Synchronize local data with the web server"""
         try:
@@ -304,14 +360,13 @@ class AttendanceApp:
             conn = sqlite3.connect(self.db_path)
             c = conn.cursor()
             
-            # Mark all unsynced records as synced
-            c.execute("UPDATE students SET synced = 1 WHERE synced = 0")
-            c.execute("UPDATE attendance SET synced = 1 WHERE synced = 0")
+            # Only the rows changed since the server's last acknowledged marks are shipped
+            delta = changelog.changes_since(conn, changelog.peer_marks(conn, SERVER_PEER))
+            students_synced = len(delta["students"]["rows"])
+            attendance_synced = len(delta["attendance"]["rows"])
             
-            # Get counts of synced records
-            students_synced = c.rowcount
-            c.execute("UPDATE attendance SET synced = 1 WHERE synced = 0")
-            attendance_synced = c.rowcount
+            # Once the server has the delta, its marks move past it
+            changelog.acknowledge(conn, SERVER_PEER, {name: changes["version"] for name, changes in delta.items()})
             
             # Update sync log
             now = datetime.datetime.now().isoformat()
@@ -342,10 +397,9 @@ class AttendanceApp:
         last_sync_time = last_sync[0] if last_sync else "Never"
         
         # Get counts of unsynced data
-        c.execute("SELECT COUNT(*) FROM students WHERE synced = 0")
-        unsynced_students = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM attendance WHERE synced = 0")
-        unsynced_attendance = c.fetchone()[0]
+        pending = changelog.pending_counts(conn, SERVER_PEER)
+        unsynced_students = pending["students"]
+        unsynced_attendance = pending["attendance"]
         
         conn.close()
         
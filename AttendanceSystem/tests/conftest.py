@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The app is imported as the top-level "attendance" package, the way app.py and migrate_db.py import it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """A connection to a freshly initialized database in tmp_path."""
+    from attendance import db
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "attendance.db"))
+    db.init_db()
+    conn = db.connect()
+    yield conn
+    conn.dispose()
@@ -0,0 +1,55 @@
+from attendance.changelog import acknowledge, changes_since, pending_counts
+
+
+def add_student(conn, name, roll):
+    cursor = conn.execute("INSERT INTO students (name, roll, class, section) VALUES (?, ?, '5', 'A')", (name, roll))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def test_changes_ship_current_rows_once(conn):
+    first = add_student(conn, "Asha", "1")
+    second = add_student(conn, "Ravi", "2")
+    conn.execute("UPDATE students SET name = 'Asha K' WHERE id = ?", (first,))
+    conn.execute("DELETE FROM students WHERE id = ?", (second,))
+    conn.commit()
+
+    students = changes_since(conn, {})["students"]
+    assert students["version"] == 4
+    assert students["rows"] == [
+        {"id": first, "name": "Asha K", "roll": "1", "class": "5", "section": "A"},
+        {"id": second, "deleted": True},
+    ]
+
+
+def test_limit_resumes_where_it_stopped(conn):
+    ids = [add_student(conn, f"Student {number}", str(number)) for number in range(5)]
+
+    first = changes_since(conn, {}, limit=2)["students"]
+    assert [row["id"] for row in first["rows"]] == ids[:2]
+    rest = changes_since(conn, {"students": first["version"]})["students"]
+    assert [row["id"] for row in rest["rows"]] == ids[2:]
+
+
+def test_acknowledge_only_moves_marks_forward(conn):
+    for number in range(3):
+        add_student(conn, f"Student {number}", str(number))
+
+    assert pending_counts(conn, "gov") == {"students": 3, "attendance": 0}
+    assert acknowledge(conn, "gov", {"students": 2}) == 2
+    # Late, repeated and out-of-range acknowledgements change nothing they should not
+    assert acknowledge(conn, "gov", {"students": 1}) == 0
+    assert acknowledge(conn, "gov", {"students": 99, "unknown": 5}) == 1
+    conn.commit()
+    assert pending_counts(conn, "gov") == {"students": 0, "attendance": 0}
+
+
+def test_changed_id_ships_delete_and_insert(conn):
+    student = add_student(conn, "Asha", "1")
+    conn.execute("UPDATE students SET id = 40 WHERE id = ?", (student,))
+    conn.commit()
+
+    assert changes_since(conn, {"students": 1})["students"]["rows"] == [
+        {"id": student, "deleted": True},
+        {"id": 40, "name": "Asha", "roll": "1", "class": "5", "section": "A"},
+    ]
@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+
+from attendance.columnar import COLUMNS, ColumnarError, read_columnar, write_columnar
+
+ROWS = [
+    (student_id, str(student_id % 5), None if student_id % 4 == 0 else f"Student {student_id % 7}",
+     "5", ["A", "B", None][student_id % 3], 19700 + student_id // 10, 1700000000 + 3600 * student_id)
+    for student_id in range(1, 50)
+]
+
+
+def rows_cursor(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"CREATE TABLE t ({', '.join(name for name, _ in COLUMNS)})")
+    conn.executemany(f"INSERT INTO t VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    return conn.execute("SELECT * FROM t ORDER BY rowid")
+
+
+def test_round_trip_across_blocks(tmp_path):
+    path = tmp_path / "export.attcol"
+    # Blocks of 8 rows: later blocks ship only the dictionary entries they add
+    assert write_columnar(rows_cursor(ROWS), path, block_rows=8) == len(ROWS)
+
+    columns = read_columnar(path)
+    assert [tuple(row) for row in zip(*(columns[name].tolist() for name, _ in COLUMNS))] == ROWS
+
+
+def test_empty_export_round_trips(tmp_path):
+    path = tmp_path / "export.attcol"
+    assert write_columnar(rows_cursor([]), path) == 0
+    assert all(len(values) == 0 for values in read_columnar(path).values())
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "export.attcol"
+    path.write_bytes(b"id,name\n")
+    with pytest.raises(ColumnarError):
+        read_columnar(path)
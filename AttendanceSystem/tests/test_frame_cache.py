@@ -0,0 +1,37 @@
+from attendance.frame_cache import FrameCache
+
+
+def cache(**settings):
+    frame_cache = FrameCache()
+    frame_cache.configure(**settings)
+    return frame_cache
+
+
+def test_near_frames_hit_within_their_partition():
+    frame_cache = cache(max_distance=2)
+    frame_cache.put("kiosk-1", 0b1111, "boxes")
+
+    assert frame_cache.get("kiosk-1", 0b1100) == "boxes"
+    assert frame_cache.get("kiosk-1", 0b1000) is None
+    assert frame_cache.get("kiosk-2", 0b1111) is None
+
+
+def test_expired_entries_are_dropped_on_lookup():
+    # With no time to live every entry has expired by the next lookup
+    frame_cache = cache(ttl=0)
+    frame_cache.put("kiosk-1", 1, "boxes")
+
+    assert frame_cache.get("kiosk-1", 1) is None
+    assert frame_cache.stats()["expired"] == 1 and frame_cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_across_partitions():
+    frame_cache = cache(max_entries=2, max_distance=0)
+    frame_cache.put("kiosk-1", 1, "a")
+    frame_cache.put("kiosk-2", 2, "b")
+    frame_cache.get("kiosk-1", 1)
+    frame_cache.put("kiosk-3", 3, "c")
+
+    assert frame_cache.get("kiosk-2", 2) is None
+    assert (frame_cache.get("kiosk-1", 1), frame_cache.get("kiosk-3", 3)) == ("a", "c")
+    assert frame_cache.stats()["evictions"] == 1
@@ -0,0 +1,30 @@
+import base64
+
+import pytest
+from flask import Flask, request
+
+from attendance.frames import FrameError, read_frame_bytes, request_params
+
+app = Flask(__name__)
+
+
+def read(**body):
+    with app.test_request_context("/scan", method="POST", **body):
+        return bytes(read_frame_bytes(request))
+
+
+def test_reads_raw_and_base64_frames():
+    assert read(data=b"jpeg bytes", content_type="image/jpeg") == b"jpeg bytes"
+    data_url = "data:image/jpeg;base64," + base64.b64encode(b"jpeg bytes").decode()
+    assert read(json={"image": data_url}) == b"jpeg bytes"
+
+
+@pytest.mark.parametrize("body", [[], ["image"], {"image": 1}, {"image": ["x"]}, {"image": "not base64!"}, {}])
+def test_unusable_json_bodies_are_frame_errors(body):
+    with pytest.raises(FrameError):
+        read(json=body)
+
+
+def test_later_sources_override_earlier_ones():
+    with app.test_request_context("/scan?mode=single&room=1", method="POST", json={"mode": "group", "image": "x"}):
+        assert request_params(request) == {"mode": "group", "room": "1"}
@@ -0,0 +1,53 @@
+import numpy as np
+
+from attendance import face_index
+from attendance.gallery import FaceGallery
+from attendance.matching import ENCODING_SIZE
+
+
+def add_student(conn, name, seed):
+    encoding = np.random.default_rng(seed).random(ENCODING_SIZE)
+    cursor = conn.execute("INSERT INTO students (name, roll, face_encoding) VALUES (?, ?, ?)",
+                          (name, str(seed), encoding.tobytes()))
+    conn.commit()
+    return cursor.lastrowid, encoding
+
+
+def test_writes_patch_the_snapshot(conn):
+    gallery = FaceGallery()
+    first, encoding = add_student(conn, "Asha", 1)
+    assert list(gallery.get(conn).ids) == [first]
+
+    second, _ = add_student(conn, "Ravi", 2)
+    gallery.upsert(conn, second)
+    conn.execute("DELETE FROM students WHERE id = ?", (first,))
+    conn.commit()
+    gallery.remove(conn, first)
+
+    snapshot = gallery.get(conn)
+    assert list(snapshot.ids) == [second]
+    assert (gallery.reloads, gallery.patches) == (1, 2)
+
+
+def test_indexes_are_built_outside_the_lock(conn, monkeypatch):
+    gallery = FaceGallery()
+    gallery.configure(threshold=1, path=None)
+    build_index = face_index.build_index
+    held = []
+
+    def checked_build(*args):
+        held.append(gallery._lock.locked())
+        return build_index(*args)
+
+    monkeypatch.setattr(face_index, "build_index", checked_build)
+    for seed in range(3):
+        add_student(conn, f"Student {seed}", seed)
+    gallery.get(conn)
+    gallery.get_scoped(conn, frozenset([("", "")]))
+    # Doubling the gallery since training makes a patch retrain its index
+    for seed in range(3, 7):
+        student, _ = add_student(conn, f"Student {seed}", seed)
+        gallery.upsert(conn, student)
+
+    assert len(held) == 3 and not any(held)
+    assert student in gallery.get(conn).ids
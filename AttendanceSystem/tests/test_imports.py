@@ -0,0 +1,71 @@
+import io
+
+import pytest
+
+from attendance.imports import RecordError, parse_ndjson, run_import
+
+
+def records(count, day="2024-03-01"):
+    return [{"roll": str(number), "name": f"Student {number}", "class": "5", "section": "A",
+             "timestamp": f"{day} 09:{number % 60:02d}:00"} for number in range(count)]
+
+
+def numbered(records):
+    return list(enumerate(records, 1))
+
+
+def attendance_rows(conn):
+    return conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+
+
+def test_retried_upload_is_not_applied_twice(conn):
+    first = run_import(conn, numbered(records(25)), key="upload-1", batch_size=10)
+    assert (first["imported"], first["students_created"], first["batches"]) == (25, 25, 3)
+
+    retry = run_import(conn, numbered(records(25)), key="upload-1", batch_size=10)
+    assert (retry["imported"], retry["replayed_batches"]) == (0, 3)
+    assert attendance_rows(conn) == 25
+
+
+@pytest.mark.parametrize("retry_batch_size", [4, 10, 30])
+def test_retry_resumes_after_a_batch_size_change(conn, retry_batch_size):
+    # The first attempt commits records 0-9, then fails on record 14
+    broken = records(25)
+    broken[14]["timestamp"] = "soon"
+    with pytest.raises(RecordError):
+        run_import(conn, numbered(broken), key="upload-1", batch_size=10)
+    assert attendance_rows(conn) == 10
+
+    # Marked under other students, so a re-import of the first ten would show
+    fixed = [dict(record, roll=f"new {number}") if number < 10 else record
+             for number, record in enumerate(records(25))]
+    retry = run_import(conn, numbered(fixed), key="upload-1", batch_size=retry_batch_size)
+    assert (retry["records"], retry["imported"], retry["replayed_batches"]) == (25, 15, 1)
+    assert attendance_rows(conn) == 25
+
+
+def test_one_mark_per_student_and_day(conn):
+    result = run_import(conn, numbered(records(5) + records(5) + records(5, day="2024-03-02")))
+    assert (result["imported"], result["duplicates"], result["students_created"]) == (10, 5, 5)
+
+
+def test_unreadable_timestamp_rejects_its_batch(conn):
+    batch = records(4)
+    batch[2]["timestamp"] = "yesterday"
+    with pytest.raises(RecordError) as error:
+        run_import(conn, numbered(batch))
+    assert error.value.line == 3
+    assert attendance_rows(conn) == 0
+
+
+def test_ndjson_errors_name_their_line(conn):
+    body = io.StringIO('{"roll": "1", "timestamp": "2024-03-01 09:00:00"}\n{"roll": \n')
+    with pytest.raises(RecordError) as error:
+        list(parse_ndjson(body))
+    assert error.value.line == 2
+
+    # Blank lines still count
+    body = io.StringIO('\n{"roll": "1", "timestamp": "2024-03-01 09:00:00"}\n\n\n{"roll": "2", "timestamp": "x"}\n')
+    with pytest.raises(RecordError) as error:
+        run_import(conn, parse_ndjson(body))
+    assert error.value.line == 5
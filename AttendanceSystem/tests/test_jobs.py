@@ -0,0 +1,8 @@
+from attendance.jobs import ScanJobs
+
+
+def test_same_frame_from_two_kiosks_is_two_jobs():
+    params = {"room": "5A"}
+    assert ScanJobs.job_key(b"frame", params, "kiosk-1") == ScanJobs.job_key(b"frame", dict(params), "kiosk-1")
+    assert ScanJobs.job_key(b"frame", params, "kiosk-1") != ScanJobs.job_key(b"frame", params, "kiosk-2")
+    assert ScanJobs.job_key(b"frame", params) != ScanJobs.job_key(b"frame", {"room": "5B"})
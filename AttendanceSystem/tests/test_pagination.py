@@ -0,0 +1,46 @@
+import pytest
+
+from attendance.pagination import CursorError, keyset_page
+from attendance.routes_attendance import LOGS_KEYS, LOGS_SELECT, STUDENTS_KEYS, STUDENTS_SELECT
+
+
+def all_pages(conn, select, keys, limit, descending=False):
+    """Every row keyset_page() returns, following next_cursor to the last page."""
+    rows, cursor = [], None
+    while True:
+        page, cursor = keyset_page(conn, select, [], [], keys, cursor, limit, descending=descending)
+        rows.extend(page)
+        if cursor is None:
+            return rows
+
+
+def test_logs_pages_include_rows_without_ts(conn):
+    conn.execute("INSERT INTO students (id, name, roll) VALUES (1, 'Asha', '1')")
+    conn.executemany("INSERT INTO attendance (student_id, timestamp, day, ts) VALUES (1, ?, ?, ?)", [
+        ("2024-01-01 09:00:00", "2024-01-01", 1704099600),
+        ("garbled", None, None),
+        ("2024-01-02 09:00:00", "2024-01-02", 1704186000),
+        ("2024-01-03 09:00:00", "2024-01-03", 1704272400),
+    ])
+    conn.commit()
+
+    for limit in (1, 2, 3):
+        rows = all_pages(conn, LOGS_SELECT, LOGS_KEYS, limit, descending=True)
+        # Newest first, the unreadable timestamp last
+        assert [row[3] for row in rows] == ["2024-01-03 09:00:00", "2024-01-02 09:00:00", "2024-01-01 09:00:00",
+                                            "garbled"]
+
+
+def test_student_pages_include_students_without_name(conn):
+    conn.executemany("INSERT INTO students (name, roll) VALUES (?, ?)",
+                     [(None if number % 3 == 0 else f"name {number % 4}", str(number)) for number in range(20)])
+    conn.commit()
+
+    rows = all_pages(conn, STUDENTS_SELECT, STUDENTS_KEYS, 3)
+    assert sorted(row[0] for row in rows) == list(range(1, 21))
+    assert [row[1] for row in rows[:7]] == [None] * 7
+
+
+def test_bad_cursor_is_rejected(conn):
+    with pytest.raises(CursorError):
+        keyset_page(conn, STUDENTS_SELECT, [], [], STUDENTS_KEYS, "not a cursor")
@@ -0,0 +1,13 @@
+import pytest
+
+from attendance.query_plans import QUERY_PLAN_CHECKS, check_query_plans
+
+
+def test_checks_cover_the_hot_paths():
+    assert {"logs_page", "students_page", "reports_page", "export_all", "today_count"} <= set(QUERY_PLAN_CHECKS)
+
+
+@pytest.mark.parametrize("name", sorted(QUERY_PLAN_CHECKS))
+def test_query_uses_its_index(conn, name):
+    ok, plan = check_query_plans(conn)[name]
+    assert ok, f"{name} no longer uses {QUERY_PLAN_CHECKS[name][2]}: {plan}"
@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from attendance import recognition
+from attendance.workers import PoolBroken, RecognitionPool
+
+
+class DeadExecutor:
+    """An executor whose worker died: every job fails with BrokenProcessPool."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_dead_worker_restarts_the_pool():
+    pool = RecognitionPool()
+    dead = pool._executor = DeadExecutor()
+
+    with pytest.raises(PoolBroken):
+        pool.run(abs, -1)
+    assert dead.shut_down and pool._executor is None
+    assert pool.stats()["failures"] == 1
+    assert pool.stats()["outstanding"] == 0
+
+
+def test_dead_worker_is_answered_with_503(monkeypatch):
+    def run(job, *args):
+        raise PoolBroken("A recognition worker died")
+
+    monkeypatch.setattr(recognition.recognition_pool, "run", run)
+    detection, (body, status) = recognition._detect(abs, -1)
+    assert detection is None and status == 503 and not body["success"]